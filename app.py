@@ -1,16 +1,33 @@
 
 
-from flask import Flask, render_template, flash, redirect
+from flask import Flask, render_template, flash, redirect, jsonify, url_for, Response
 from flask_bootstrap import Bootstrap
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, FileField, SelectMultipleField
+from wtforms import StringField, SubmitField, FileField, SelectMultipleField, BooleanField
 from wtforms.validators import DataRequired
 from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms.widgets import PasswordInput
+from werkzeug.datastructures import FileStorage
+import os
+import logging
+import threading
+from datetime import datetime
 import yaml
 
-from parsefit import fitfile
+# parsefit (pandas, fitparse, db stack) is imported on the first upload or by prewarm(): the form is served at once
+import jobs
+import metrics
 
+log_dir = 'log'
+
+def setup_logging() :
+    # once per process: a log file per app start (parsefit and its worker processes do not configure logging)
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, 'g2h_' + datetime.now().strftime('%Y%m%d_%H%M'))
+    logging.basicConfig(level=logging.INFO,handlers=[
+            logging.FileHandler(log_file),
+            logging.StreamHandler()
+        ])
 
 with open('config.yaml') as yamls:
     params = yaml.safe_load(yamls)
@@ -21,6 +38,9 @@ db = {'host': params['HDB_HOST'],
       'port': params['HDB_PORT'],
       'schema' : params['SCHEMA'] }
 
+workers = params.get('WORKERS', 1)
+prewarm_parser = params.get('PREWARM', True)  # import parsefit in the background right after the start
+
 athlete = {'user': params['appuser'],'pwd': params['apppwd']}
 
 
@@ -37,8 +57,22 @@ class uploadForm(FlaskForm):
                                                  ('swimming_pool', 'Swimming Pool'),
                                                  ('swimming_open_water','Swimming Open Water')],validators=[DataRequired()])
     fitfile = FileField('Document', validators=[FileRequired(),FileAllowed(['zip','fit','gz'], 'zip and fit only!')])
+    force = BooleanField('Re-import already imported files')
     submit = SubmitField('Submit')
 
+def prewarm() :
+    with metrics.timer('import_parsefit') :
+        import parsefit
+    logging.info('Parsing stack loaded')
+
+def run_upload(path,filename,progress,sports,force) :
+    # waits for a running prewarm() (import lock)
+    from parsefit import fitfile
+    with open(path,'rb') as f :
+        return fitfile(FileStorage(stream=f, filename=filename),sports,db,workers,force,progress)
+
+upload_jobs = jobs.JobQueue(run_upload, workers=params.get('JOB_WORKERS'), maxsize=params.get('MAX_QUEUED_UPLOADS'))
+
 @app.route('/', methods = ['GET','POST'])
 def index():
 
@@ -56,15 +90,33 @@ def index():
             render_template('upload.html', form=uploadform)
         else :
             sports = uploadform.sport.data
-            fitfile(uploadform.fitfile.data,sports,db)
-            #except Exception as e :
-            #    flash('Exception: {}'.format(e),'warning')
-             #   render_template('upload.html', form=uploadform)
-
-            flash('Data uploaded successfully!','success')
+            upload = uploadform.fitfile.data
+            try :
+                job_id = upload_jobs.submit(upload.stream, upload.filename, sports=sports, force=uploadform.force.data)
+                flash('Upload accepted, processing in the background. Status: {}'
+                      .format(url_for('status', job_id=job_id, _external=True)),'success')
+            except jobs.QueueFull as e :
+                flash('{} - please try again later.'.format(e),'warning')
             render_template('upload.html', form=uploadform)
 
     return render_template('upload.html', form=uploadform)
 
+@app.route('/status/<job_id>')
+def status(job_id):
+    job = upload_jobs.status(job_id)
+    if job is None :
+        return jsonify({'id': job_id, 'state': 'unknown'}), 404
+    return jsonify(job)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    lines = ['# HELP g2h_upload_jobs Upload jobs per state', '# TYPE g2h_upload_jobs gauge']
+    for state, number in upload_jobs.states().items() :
+        lines.append('g2h_upload_jobs{{state="{}"}} {}'.format(state, number))
+    return Response(metrics.exposition() + '\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
+    setup_logging()
+    if prewarm_parser :
+        threading.Thread(target=prewarm, name='prewarm', daemon=True).start()
     app.run('0.0.0.0',port=8080)
@@ -0,0 +1,221 @@
+###
+# Bulk ingestion of directory trees of .fit, .fit.gz and .zip files (backfill of exports)
+# The files (zip members count as files) are processed in rounds of --round files: parsed in a worker pool,
+# written in table batches, then the ledger entries and the checkpoint are written. An interrupted run started
+# again with the same checkpoint skips the finished rounds' files. --dry-run parses only (no db, ledger, dump
+# or checkpoint) for throughput measurements. At the end: files per status, files/s, rows/s and the slowest stages.
+#
+# python backfill.py <dir or file> ... [--sports ...] [--workers 4] [--checkpoint file] [--dry-run]
+#                                      [--sqlite db] [--config config.yaml] [--force] [--round 500]
+###
+
+import os
+import sys
+import time
+import zipfile
+import logging
+import argparse
+from functools import partial
+
+import yaml
+
+import parsefit
+import sportschema
+import hanawriter
+import ingestledger
+import metrics
+
+extensions = ['.fit', '.gz', '.zip']
+round_files = 500  # files per round (checkpoint interval)
+checkpoint_file = 'backfill.checkpoint'
+
+
+def db_config(config):
+    with open(config) as yamls:
+        params = yaml.safe_load(yamls)
+    return {'host': params['HDB_HOST'], 'user': params['HDB_USER'], 'pwd': params['HDB_PWD'],
+            'port': params['HDB_PORT'], 'schema': params['SCHEMA']}
+
+
+def input_files(paths):
+    # .fit/.gz/.zip files of the paths (directories recursively), sorted
+    for p in paths:
+        if os.path.isfile(p):
+            yield os.path.abspath(p)
+            continue
+        for root, dirs, files in os.walk(p):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in extensions and not name.startswith('.'):
+                    yield os.path.abspath(os.path.join(root, name))
+
+
+def fit_files(paths):
+    # (name, file path, zip member or None) of every FIT file, zip members named <archive>/<member>
+    for file in input_files(paths):
+        if os.path.splitext(file)[1].lower() != '.zip':
+            yield file, file, None
+            continue
+        try:
+            with zipfile.ZipFile(file) as zip:
+                members = [m for m in zip.namelist() if os.path.splitext(m)[1] in ['.fit', '.gz']]
+        except (OSError, zipfile.BadZipFile) as e:
+            logging.warning('Skipped archive {}: {}'.format(file, e))
+            continue
+        for member in members:
+            yield os.path.join(file, member), file, member
+
+
+class Checkpoint:
+    # names of the finished files, one per line; appended after each round (once its data and ledger are written)
+
+    def __init__(self, path=None):
+        self.path = path
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as inp:
+                self.done = {line.rstrip('\n') for line in inp if line.strip()}
+
+    def add(self, names):
+        self.done.update(names)
+        if not self.path or not names:
+            return
+        with open(self.path, 'a') as out:
+            out.write(''.join(name + '\n' for name in names))
+            out.flush()
+            os.fsync(out.fileno())
+
+
+def round_items(files, sports, archives):
+    # parsefit.parallel_parse items of the files of a round (archives: zip files opened in this process)
+    for name, file, member in files:
+        if member is None:
+            yield name, parsefit.parse_path, (file, sports), partial(open, file, 'rb')
+        else:
+            if file not in archives:
+                archives[file] = zipfile.ZipFile(file)
+            yield name, parsefit.parse_archive_member, (file, member, sports), partial(archives[file].open, member)
+
+
+def run_round(files, sports, db, workers, force, ledger):
+    upload = parsefit.Upload(sports, db, force, ledger)
+    upload.result['total'] = len(files)
+    archives = dict()
+    try:
+        with metrics.capture(upload.timings), hanawriter.Batcher(db) as upload.batcher:
+            items = round_items(files, sports, archives)
+            if workers > 1:
+                parsefit.parallel_parse(items, upload, workers)
+            else:
+                for name, _, _, opener in items:
+                    upload.ingest_from(name, opener)
+        # ledger entries only after the data is written
+        if ledger:
+            ledger.flush()
+    finally:
+        for archive in archives.values():
+            archive.close()
+    # stages of all threads of the round (the writer thread of parallel_parse saves the large files)
+    upload.result['timings'] = upload.timings
+    return upload.result
+
+
+def add_result(total, timings, result):
+    for key in ['total', 'files', 'new', 'parsed', 'imported', 'unselected', 'failed']:
+        total[key] += result[key]
+    total['errors'] += result['errors'][:parsefit.max_errors - len(total['errors'])]
+    for stage, entry in result['timings'].items():
+        metrics.add(timings, stage, **entry)
+
+
+def saved_count(total):
+    # label and number of the accepted files: 'parsed' in a dry run (nothing written), else 'new'
+    return ('parsed', total['parsed']) if total['parsed'] else ('new', total['new'])
+
+
+def report(total, timings, seconds):
+    stages = metrics.summary(timings)
+    rows = sum(stages.get(stage, {}).get('rows', 0) for stage in ['fit2df', 'chunked'])
+    size = stages.get('decompress', {}).get('bytes', 0)
+    seconds = max(seconds, 1e-9)
+    print('Files: {files} ({} {}, imported {imported}, unselected {unselected}, failed {failed})'.format(
+        *saved_count(total), **total))
+    print('Records: {} in {:.1f} s'.format(rows, seconds))
+    print('Throughput: {:.2f} files/s, {:.0f} rows/s, {:.2f} MB/s FIT data'.format(
+        total['files'] / seconds, rows / seconds, size / 2 ** 20 / seconds))
+    if stages:
+        print('Slowest stages: {}'.format(', '.join('{} {:.1f} s'.format(stage, entry['seconds'])
+                                                     for stage, entry in list(stages.items())[:5])))
+    for error in total['errors']:
+        print('Failed: {file}: {error}'.format(**error))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk ingestion of .fit/.gz/.zip files (directories recursively)')
+    parser.add_argument('paths', nargs='+', help='directories or files')
+    parser.add_argument('--sports', nargs='+', default=list(sportschema.sports), choices=list(sportschema.sports))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='parsing processes')
+    parser.add_argument('--round', type=int, default=round_files, help='files per round (checkpoint interval)')
+    parser.add_argument('--checkpoint', default=checkpoint_file, help='finished files, resumes an interrupted run')
+    parser.add_argument('--dry-run', action='store_true', help='parse only: no db, ledger, dump or checkpoint')
+    parser.add_argument('--force', action='store_true', help='re-import files and workouts of the ledger')
+    parser.add_argument('--config', default='config.yaml', help='HANA connection (as the app)')
+    parser.add_argument('--sqlite', help='write to this sqlite database instead of HANA')
+    parser.add_argument('--dump-dir', default=parsefit.dump_dir, help='Parquet dump of the workouts')
+    parser.add_argument('--no-dump', action='store_true')
+    parser.add_argument('--verbose', action='store_true', help='log every file')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    parsefit.local_test = args.dry_run
+    parsefit.dump_parquet = not (args.dry_run or args.no_dump)
+    parsefit.dump_dir = args.dump_dir
+    if args.dry_run:
+        db = dict()
+    elif args.sqlite:
+        db = {'dialect': 'sqlite', 'database': args.sqlite}
+    else:
+        db = db_config(args.config)
+    ledger = None
+    if parsefit.use_ledger and not args.dry_run:
+        ledger = ingestledger.Ledger(db, parsefit.test_table(ingestledger.ledger_table))
+    checkpoint = Checkpoint(None if args.dry_run else args.checkpoint)
+    if checkpoint.done:
+        print('Resuming: {} files finished ({})'.format(len(checkpoint.done), args.checkpoint))
+
+    total = {'total': 0, 'files': 0, 'new': 0, 'parsed': 0, 'imported': 0, 'unselected': 0, 'failed': 0,
+             'errors': list()}
+    timings = dict()
+    start = time.perf_counter()
+    pending = list()
+
+    def run(files):
+        result = run_round(files, args.sports, db, args.workers, args.force, ledger)
+        add_result(total, timings, result)
+        checkpoint.add([name for name, _, _ in files])
+        elapsed = time.perf_counter() - start
+        print('{} files ({:.2f} files/s): {} {}, imported {imported}, unselected {unselected}, '
+              'failed {failed}'.format(total['files'], total['files'] / elapsed, *saved_count(total), **total))
+
+    try:
+        for item in fit_files(args.paths):
+            if item[0] in checkpoint.done:
+                continue
+            pending.append(item)
+            if len(pending) >= args.round:
+                run(pending)
+                pending = list()
+        if pending:
+            run(pending)
+    except KeyboardInterrupt:
+        print('Interrupted: the unfinished round is imported again when started with the same checkpoint')
+        report(total, timings, time.perf_counter() - start)
+        hanawriter.close_pools()
+        return 130
+    report(total, timings, time.perf_counter() - start)
+    hanawriter.close_pools()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
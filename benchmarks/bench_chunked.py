@@ -0,0 +1,47 @@
+###
+# Benchmark: uploading very long FIT files
+# whole file (fit2df, then save) vs. chunk by chunk (FitChunks, parsefit.chunk_records per chunk), both written to
+# the sqlite stand-in. Time and peak memory (tracemalloc) of the whole upload.
+#
+# python -m benchmarks.bench_chunked [hours ...]
+###
+
+import sys
+import io
+import os
+import logging
+import tempfile
+
+from benchmarks.synthfit import synth_fit
+from benchmarks.bench_records import measure
+from benchmarks.suite import create_tables
+import parsefit
+import hanawriter
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def upload(data, chunked, db):
+    parsefit.chunked_size = 0 if chunked else 2 ** 40
+    stream = io.BytesIO(data)
+    stream.filename = 'long.fit'
+    return parsefit.fitfile(stream, ['cycling_outdoor'], db, force=True)
+
+
+if __name__ == '__main__':
+
+    hours = [float(h) for h in sys.argv[1:]] or [4, 12]
+    parsefit.local_test = False
+    parsefit.dump_parquet = False
+    print('{:>6} {:>9} {:>11} {:>13} {:>12} {:>14}'.format('hours', 'records', 'whole[s]', 'whole[MB]', 'chunked[s]',
+                                                           'chunked[MB]'))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = {'dialect': 'sqlite', 'database': os.path.join(tmpdir, 'bench.db')}
+        create_tables(db['database'], ['cycling_outdoor'])
+        for h in hours:
+            data = synth_fit('cycling_outdoor', duration=int(h * 3600))
+            t_whole, m_whole, _ = measure(lambda d: upload(d, False, db), data)
+            t_chunked, m_chunked, _ = measure(lambda d: upload(d, True, db), data)
+            print('{:>6} {:>9} {:>11.2f} {:>13.1f} {:>12.2f} {:>14.1f}'.format(
+                h, int(h * 3600), t_whole, m_whole / 2 ** 20, t_chunked, m_chunked / 2 ** 20))
+        hanawriter.close_pools()
@@ -0,0 +1,89 @@
+###
+# Benchmark: compaction of the records (compaction)
+# Per sport and steps: records and positions kept, time, and the deviation of the expanded records
+# (compaction.expand) from the full ones: mean-max power/HR (>= 60 s and all durations), averages of the
+# session, max. position error.
+#
+# python -m benchmarks.bench_compaction [hours]
+###
+
+import sys
+import io
+import time
+import logging
+
+import numpy as np
+
+from benchmarks.synthfit import synth_fit, PROFILES
+import parsefit
+import sportschema
+import compaction
+from utils import bestinterval
+
+logging.getLogger().setLevel(logging.WARNING)
+
+selections = [['collapse'], ['track'], ['bucket'], ['track', 'collapse'], compaction.steps]
+averaged = ['heart_rate', 'power', 'cadence', 'enhanced_speed']
+
+
+def deviation(full, expanded):
+    # max. relative deviation in %
+    full = np.asarray(full, dtype=np.float64)
+    expanded = np.asarray(expanded, dtype=np.float64)
+    mask = full != 0
+    if not mask.any():
+        return 0.
+    return float(np.max(np.abs(expanded[mask] - full[mask]) / np.abs(full[mask]))) * 100
+
+
+def mean_max(full, expanded, min_duration=1):
+    durations = [d for d in sportschema.mean_max_durations if min_duration <= d <= len(full)]
+    result = 0.
+    for col in ['power', 'heart_rate']:
+        if col in full.columns and durations:
+            result = max(result, deviation(bestinterval.mean_max(full[col].to_numpy(), durations),
+                                           bestinterval.mean_max(expanded[col].to_numpy(), durations)))
+    return result
+
+
+def averages(full, expanded):
+    result = 0.
+    for col in averaged:
+        if col in full.columns:
+            fill = sportschema.columns.get(col, (None, 0))[1]
+            result = max(result, deviation([full[col][full[col] != fill].mean()],
+                                           [expanded[col][expanded[col] != fill].mean()]))
+    return result
+
+
+def position_error(full, expanded):
+    if compaction.positions(full) == 0:
+        return 0.
+    # one projection for both
+    lat = np.concatenate([full['position_lat'].to_numpy(np.float64), expanded['position_lat'].to_numpy(np.float64)])
+    long = np.concatenate([full['position_long'].to_numpy(np.float64),
+                           expanded['position_long'].to_numpy(np.float64)])
+    x, y = compaction.metres(lat, long)
+    x0, x1 = np.split(x, 2)
+    y0, y1 = np.split(y, 2)
+    return float(np.hypot(x1 - x0, y1 - y0).max())
+
+
+if __name__ == '__main__':
+
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    print('{:<20} {:<26} {:>8} {:>7} {:>10} {:>8} {:>12} {:>12} {:>9} {:>8}'.format(
+        'sport', 'steps', 'records', 'ratio', 'positions', 'time[s]', 'mm>=60s[%]', 'mm all[%]', 'avg[%]',
+        'pos[m]'))
+    for sport in PROFILES:
+        sport, df, _ = parsefit.fit2df(io.BytesIO(synth_fit(sport, duration=int(hours * 3600), pauses=2)))
+        for selected in selections:
+            start = time.perf_counter()
+            kept, stats = compaction.compact(df, sport, selected)
+            elapsed = time.perf_counter() - start
+            expanded = compaction.expand(kept, selected)
+            assert len(expanded) == len(df)
+            print('{:<20} {:<26} {:>8} {:>7.1f} {:>10} {:>8.3f} {:>12.2f} {:>12.2f} {:>9.2f} {:>8.2f}'.format(
+                sport, compaction.name(selected), stats['kept_records'], stats['records'] / stats['kept_records'],
+                stats['kept_positions'], elapsed, mean_max(df, expanded, 60), mean_max(df, expanded),
+                averages(df, expanded), position_error(df, expanded)))
@@ -0,0 +1,48 @@
+###
+# Benchmark: compact dtypes of the parsed frames
+# float64/int64/object frames (former) vs. sportschema.compact_dtypes, both with the per-row zone strings.
+# Memory per sample of the frame (pandas deep), time and peak memory (tracemalloc) of the upsert payload:
+# .values.tolist() (former) vs. the column-wise hanawriter.rows_of()
+#
+# python -m benchmarks.bench_dtypes [hours ...]
+###
+
+import sys
+import io
+import logging
+
+from benchmarks.synthfit import synth_fit
+from benchmarks.bench_records import measure
+import parsefit
+import hanawriter
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def frame(data, compact):
+    parsefit.compact_frames = compact
+    parsefit.row_zones = True
+    _, df, _ = parsefit.fit2df(io.BytesIO(data))
+    return df
+
+
+def values_tolist(df):
+    return df.values.tolist()
+
+
+if __name__ == '__main__':
+
+    hours = [float(h) for h in sys.argv[1:]] or [1, 5, 10]
+    print('{:>6} {:>9} {:>12} {:>15} {:>10} {:>10} {:>12} {:>12}'.format(
+        'hours', 'records', 'wide[B/rec]', 'compact[B/rec]', 'wide[s]', 'compact[s]', 'wide[MB]', 'compact[MB]'))
+    for h in hours:
+        for sport in ['cycling_outdoor', 'cycling_indoor']:
+            data = synth_fit(sport, duration=int(h * 3600))
+            wide = frame(data, False)
+            compact = frame(data, True)
+            t_wide, m_wide, _ = measure(values_tolist, wide)
+            t_compact, m_compact, _ = measure(hanawriter.rows_of, compact)
+            print('{:>6} {:>9} {:>12.1f} {:>15.1f} {:>10.3f} {:>10.3f} {:>12.1f} {:>12.1f}  {}'.format(
+                h, len(wide), wide.memory_usage(deep=True).sum() / len(wide),
+                compact.memory_usage(deep=True).sum() / len(compact), t_wide, t_compact, m_wide / 2 ** 20,
+                m_compact / 2 ** 20, sport))
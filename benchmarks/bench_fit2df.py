@@ -0,0 +1,47 @@
+###
+# Benchmark: message extraction in fit2df
+# one get_messages() pass per message type (former fit2df) vs. single pass read_messages()
+#
+# python -m benchmarks.bench_fit2df [hours ...]
+###
+
+import sys
+import io
+import time
+import logging
+
+from fitparse import FitFile
+
+from benchmarks.synthfit import synth_fit
+import parsefit
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def per_type_passes(bfile):
+    fitfile = FitFile(bfile)
+    return {name: [rec.get_values() for rec in fitfile.get_messages(name)] for name in parsefit.fit_messages}
+
+
+def timeit(func, data, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(io.BytesIO(data))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+
+    hours = [float(h) for h in sys.argv[1:]] or [1, 3, 6]
+    print('{:>6} {:>9} {:>12} {:>12} {:>12} {:>8}'.format('hours', 'records', 'per-type[s]', 'single[s]',
+                                                          'fit2df[s]', 'gain'))
+    for h in hours:
+        data = synth_fit('cycling_outdoor', duration=int(h * 3600))
+        t_passes = timeit(per_type_passes, data)
+        t_single = timeit(parsefit.read_messages, data)
+        t_fit2df = timeit(parsefit.fit2df, data, repeat=1)
+        print('{:>6} {:>9} {:>12.3f} {:>12.3f} {:>12.3f} {:>7.1%}'.format(h, int(h * 3600), t_passes, t_single,
+                                                                         t_fit2df, 1 - t_single / t_passes))
@@ -0,0 +1,59 @@
+###
+# Benchmark: building the record DataFrame
+# list of dicts + pd.DataFrame (former fit2df) vs. columnar RecordColumns
+# The messages are decoded once beforehand, time and peak memory (tracemalloc) cover the build only.
+#
+# python -m benchmarks.bench_records [hours ...]
+###
+
+import sys
+import io
+import time
+import tracemalloc
+import logging
+
+import pandas as pd
+from fitparse import FitFile
+
+from benchmarks.synthfit import synth_fit
+import parsefit
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def dict_records(messages):
+    records = [rec.get_values() for rec in messages]
+    return pd.DataFrame(records)
+
+
+def columnar_records(messages):
+    columns = parsefit.RecordColumns()
+    for msg in messages:
+        columns.append(msg)
+    return columns.to_frame()
+
+
+def measure(func, messages):
+    # timing without tracemalloc (slows down allocations), peak memory in a second run
+    start = time.perf_counter()
+    func(messages)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    df = func(messages)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, df
+
+
+if __name__ == '__main__':
+
+    hours = [float(h) for h in sys.argv[1:]] or [1, 5, 10]
+    print('{:>6} {:>9} {:>10} {:>12} {:>10} {:>12}'.format('hours', 'records', 'dicts[s]', 'dicts[MB]',
+                                                          'columns[s]', 'columns[MB]'))
+    for h in hours:
+        data = synth_fit('cycling_outdoor', duration=int(h * 3600))
+        messages = list(FitFile(io.BytesIO(data)).get_messages('record'))
+        t_dicts, m_dicts, _ = measure(dict_records, messages)
+        t_cols, m_cols, _ = measure(columnar_records, messages)
+        print('{:>6} {:>9} {:>10.3f} {:>12.1f} {:>10.3f} {:>12.1f}'.format(h, len(messages), t_dicts, m_dicts / 2 ** 20,
+                                                                          t_cols, m_cols / 2 ** 20))
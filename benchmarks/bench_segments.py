@@ -0,0 +1,85 @@
+###
+# Benchmark: elapsed time per timer segment
+# merge of the start events on the record timestamps + groupby (former fit2df) vs. np.isin + cumsum (former
+# parsefit.elapsed_time) vs. segments.Timer (searchsorted on the events: segment, elapsed and timer time; timing()
+# adds the moving time). Records every second, a stop/start pair every 10 minutes; 'off' starts the segments half a
+# second after a record: records of the segments missed by the exact-match versions.
+#
+# python -m benchmarks.bench_segments [hours ...]
+###
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import segments
+
+
+def workout(hours, offset=0.):
+    start = datetime(2021, 3, 22, 8)
+    n = int(hours * 3600)
+    ts = pd.date_range(start, periods=n, freq='s').to_numpy()
+    events = [{'event': 'timer', 'event_type': 'start', 'timestamp': start}]
+    for s in range(600, n, 600):
+        events.append({'event': 'timer', 'event_type': 'stop', 'timestamp': start + timedelta(seconds=s - 1)})
+        events.append({'event': 'timer', 'event_type': 'start', 'timestamp': start + timedelta(seconds=s + offset)})
+    events.append({'event': 'timer', 'event_type': 'stop_all', 'timestamp': start + timedelta(seconds=n - 1)})
+    df = pd.DataFrame({'timestamp': ts, 'enhanced_speed': np.full(n, 8.), 'distance': np.arange(n) * 8.})
+    return df, events
+
+
+def merged(df, events):
+    df_events = pd.DataFrame(events)
+    df_events = df_events.loc[(df_events['event'] == 'timer') & (df_events['event_type'] == 'start'),
+                              ['timestamp', 'event_type']]
+    df = df.merge(df_events, how='left', on='timestamp')
+    elapsed = df['timestamp'] - df['timestamp'].groupby(df['event_type'].eq('start').cumsum()).transform('first')
+    return elapsed.dt.total_seconds().to_numpy()
+
+
+def isin(df, events):
+    ts = df['timestamp'].to_numpy()
+    starts = np.array([e['timestamp'] for e in events if e['event_type'] == 'start'], dtype='datetime64[ns]')
+    is_start = np.isin(ts, starts)
+    firsts = np.concatenate([ts[:1], ts[is_start]])
+    return (ts - firsts[np.cumsum(is_start)]) / np.timedelta64(1, 's')
+
+
+def timer(df, events):
+    return segments.Timer(events).place(df['timestamp'].to_numpy())['elapsed_time']
+
+
+def timing(df, events):
+    return segments.Timer(events).timing(df)
+
+
+def best(func, *args, repeat=5):
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == '__main__':
+
+    hours = [float(h) for h in sys.argv[1:]] or [1, 6, 24]
+    print('{:>6} {:>9} {:>5} {:>10} {:>9} {:>9} {:>10} {:>8}'.format('hours', 'records', 'off', 'merge[ms]',
+                                                                       'isin[ms]', 'Timer[ms]', 'timing[ms]',
+                                                                       'missed'))
+    for h in hours:
+        for offset in (0., 0.5):
+            df, events = workout(h, offset)
+            t_merge, e_merge = best(merged, df, events)
+            t_isin, e_isin = best(isin, df, events)
+            t_timer, e_timer = best(timer, df, events)
+            t_timing, _ = best(timing, df, events)
+            # records whose elapsed time continues the previous segment
+            missed = int((np.abs(e_isin - np.round(e_timer)) > 1).sum())
+            print('{:>6} {:>9} {:>5} {:>10.2f} {:>9.2f} {:>9.2f} {:>10.2f} {:>8}'.format(
+                h, len(df), 'yes' if offset else 'no', t_merge * 1e3, t_isin * 1e3, t_timer * 1e3, t_timing * 1e3,
+                missed))
@@ -0,0 +1,85 @@
+###
+# Benchmark: cold start of app.py
+# Fresh interpreter per run (median of the runs), in a temporary directory with a dummy config.yaml:
+#   import app       app module with the lazy parsing stack (the form can be served)
+#   eager import     import app + import parsefit (app start before the lazy import)
+#   first GET /      first request of the upload form
+#   upload wait      time the first upload waits for the parsing stack (from parsefit import fitfile), without
+#                    prewarm and with prewarm() started at the app start, the upload arriving 0 s and 1 s
+#                    after the first form request
+#
+# python -m benchmarks.bench_startup [runs]
+###
+
+import os
+import sys
+import json
+import statistics
+import subprocess
+import tempfile
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+config = '''HDB_HOST: localhost
+HDB_USER: user
+HDB_PWD: pwd
+HDB_PORT: 30015
+SCHEMA: TEST
+appuser: user
+apppwd: pwd
+'''
+
+script = '''
+import time, json, threading
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+if {prewarm}:
+    threading.Thread(target=app.prewarm, daemon=True).start()
+client = app.app.test_client()
+response = client.get('/')
+assert response.status_code == 200
+served = time.perf_counter()
+time.sleep({delay})
+waiting = time.perf_counter()
+from parsefit import fitfile
+ready = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'get': served - imported, 'wait': ready - waiting}}))
+'''
+
+eager = '''
+import time, json
+start = time.perf_counter()
+import app
+import parsefit
+print(json.dumps({'import': time.perf_counter() - start}))
+'''
+
+
+def run(code, tmpdir, runs):
+    env = dict(os.environ, PYTHONPATH=repo + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    results = list()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', code], cwd=tmpdir, env=env, capture_output=True, text=True,
+                             check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {key: statistics.median(r[key] for r in results) for key in results[0]}
+
+
+if __name__ == '__main__':
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, 'config.yaml'), 'w') as out:
+            out.write(config)
+        lazy = run(script.format(prewarm=False, delay=0), tmpdir, runs)
+        before = run(eager, tmpdir, runs)
+        warm0 = run(script.format(prewarm=True, delay=0), tmpdir, runs)
+        warm1 = run(script.format(prewarm=True, delay=1), tmpdir, runs)
+    print('median of {} runs [s]'.format(runs))
+    print('{:<36} {:>8.3f}'.format('import app (lazy)', lazy['import']))
+    print('{:<36} {:>8.3f}'.format('import app + parsefit (eager)', before['import']))
+    print('{:<36} {:>8.3f}'.format('first GET /', lazy['get']))
+    print('{:<36} {:>8.3f}'.format('upload wait, no prewarm', lazy['wait']))
+    print('{:<36} {:>8.3f}'.format('upload wait, prewarm, upload at 0 s', warm0['wait']))
+    print('{:<36} {:>8.3f}'.format('upload wait, prewarm, upload at 1 s', warm1['wait']))
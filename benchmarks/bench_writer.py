@@ -0,0 +1,97 @@
+###
+# Benchmark: writing parsed workouts with hanawriter against a local sqlite3 stand-in
+# former save_data (new connection + one executemany of the whole frame per file) vs. pooled, chunked Writer
+#
+# python -m benchmarks.bench_writer [files] [hours] [connect ms]
+# 'connect ms' simulates the TLS handshake of a HANA connection (sqlite connects in microseconds)
+###
+
+import sys
+import io
+import os
+import time
+import sqlite3
+import tempfile
+import logging
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from benchmarks.synthfit import synth_fit
+import parsefit
+import sportschema
+import hanawriter
+
+logging.getLogger().setLevel(logging.WARNING)
+
+sqlite3.register_adapter(pd.Timestamp, str)
+connect_delay = 0.
+
+
+def connect(database):
+    time.sleep(connect_delay)
+    return sqlite3.connect(database, check_same_thread=False)
+
+
+def create_table(database, sport):
+    table = sportschema.sports[sport]['table']
+    cols = ', '.join('"{}"'.format(c) for c in sportschema.table_columns(sport))
+    conn = sqlite3.connect(database)
+    conn.execute('DROP TABLE IF EXISTS "{}"'.format(table))
+    conn.execute('CREATE TABLE "{}" ({}, PRIMARY KEY ("workout_id", "timestamp"))'.format(table, cols))
+    conn.commit()
+    conn.close()
+    return table
+
+
+def per_file_connect(db, table, frames, columns):
+    for df in frames:
+        conn = connect(db['database'])
+        data = df[columns].values.tolist()
+        conn.executemany('INSERT OR REPLACE INTO "{}" VALUES({})'.format(table, ','.join(['?'] * len(columns))),
+                         data)
+        conn.commit()
+        conn.close()
+
+
+def pooled_writer(db, table, frames, columns):
+    for df in frames:
+        hanawriter.upsert(db, table, df, columns)
+
+
+if __name__ == '__main__':
+
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 2
+    connect_delay = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.
+    hanawriter.dialects['sqlite']['connect'] = lambda db: connect(db['database'])
+    sport = 'cycling_outdoor'
+    columns = sportschema.table_columns(sport)
+    start = datetime(2021, 3, 1, 7, 0, tzinfo=timezone.utc)
+    frames = [parsefit.fit2df(io.BytesIO(synth_fit(sport, duration=int(hours * 3600), start=start + timedelta(days=i),
+                                                    seed=i)))[1] for i in range(num_files)]
+    num_rows = sum(len(df) for df in frames)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = {'dialect': 'sqlite', 'database': os.path.join(tmpdir, 'bench.db')}
+        print('{} files, {} rows'.format(num_files, num_rows))
+
+        table = create_table(db['database'], sport)
+        t = time.perf_counter()
+        per_file_connect(db, table, frames, columns)
+        elapsed = time.perf_counter() - t
+        print('{:<26} {:>8.3f}s {:>10.0f} rows/s {:>6} connects {:>6} round trips'.format(
+            'connect per file', elapsed, num_rows / elapsed, num_files, 2 * num_files))
+
+        for chunk_rows in [1000, 10000]:
+            table = create_table(db['database'], sport)
+            hanawriter.chunk_size = chunk_rows
+            hanawriter.reset_stats()
+            t = time.perf_counter()
+            pooled_writer(db, table, frames, columns)
+            elapsed = time.perf_counter() - t
+            stats = hanawriter.throughput()
+            print('{:<26} {:>8.3f}s {:>10.0f} rows/s {:>6} connects {:>6} round trips {:>8.1f} MB'.format(
+                'pooled, chunk {}'.format(chunk_rows), elapsed, num_rows / elapsed, stats['connects'],
+                stats['round_trips'], stats['bytes'] / 2 ** 20))
+        hanawriter.close_pools()
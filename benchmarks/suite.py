@@ -0,0 +1,239 @@
+###
+# Benchmark suite of the ingest pipeline
+# Synthetic FIT files of every sport (durations and sample intervals configurable), packaged as .fit, .fit.gz
+# and .zip. Stages: decompression (gz, zip member), fit2df, normalize, save_data (sqlite stand-in),
+# bestinterval and a whole zip upload (parsefit.fitfile). Time: best of --repeat runs, peak memory: tracemalloc
+# in a separate run. The JSON report can be compared to an earlier one (--compare), regressions above
+# --tolerance let the suite exit with 1.
+#
+# python -m benchmarks.suite [--sports ...] [--durations 3600 ...] [--intervals 1 ...] [--out report.json]
+#                            [--compare baseline.json] [--corpus dir]
+###
+
+import os
+import io
+import sys
+import gzip
+import json
+import time
+import sqlite3
+import zipfile
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthfit import synth_fit, PROFILES
+from benchmarks.bench_writer import create_table
+from utils import bestinterval
+import parsefit
+import sportschema
+import hanawriter
+import ingestledger
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def measure(func, *args, repeat=3):
+    # best time of repeat runs without tracemalloc, peak memory in one more run
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def corpus(sports, durations, intervals):
+    # {(sport, duration, interval): FIT bytes}
+    start = datetime(2021, 3, 1, 7, 0, tzinfo=timezone.utc)
+    files = dict()
+    for i, (sport, duration, interval) in enumerate([(s, d, iv) for s in sports for d in durations
+                                                     for iv in intervals]):
+        files[(sport, duration, interval)] = synth_fit(sport, duration=duration, interval=interval,
+                                                       start=start + timedelta(days=i), seed=i)
+    return files
+
+
+def file_name(sport, duration, interval):
+    return '{}_{}s_{}s.fit'.format(sport, duration, interval)
+
+
+def package(files):
+    # the corpus as .fit and .fit.gz files and as one zip upload with both (every second member gzipped)
+    packages = dict()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip:
+        for i, (key, data) in enumerate(files.items()):
+            gz = gzip.compress(data)
+            member = file_name(*key) + ('.gz' if i % 2 else '')
+            packages[key] = {'fit': data, 'gz': gz, 'member': member}
+            zip.writestr(member, gz if i % 2 else data)
+    return packages, buffer.getvalue()
+
+
+def write_corpus(directory, packages, archive):
+    os.makedirs(directory, exist_ok=True)
+    for key, data in packages.items():
+        with open(os.path.join(directory, file_name(*key)), 'wb') as out:
+            out.write(data['fit'])
+        with open(os.path.join(directory, file_name(*key) + '.gz'), 'wb') as out:
+            out.write(data['gz'])
+    with open(os.path.join(directory, 'corpus.zip'), 'wb') as out:
+        out.write(archive)
+
+
+def decompress_gz(data):
+    with parsefit.spool(gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb'), ingestledger.new_hash()) as bfile:
+        return bfile.seek(0, 2)
+
+
+def decompress_zip(archive, name):
+    with zipfile.ZipFile(io.BytesIO(archive)) as zip, zip.open(name) as source:
+        with parsefit.spool(source, ingestledger.new_hash()) as bfile:
+            return bfile.seek(0, 2)
+
+
+def fit2df(data):
+    return parsefit.fit2df(io.BytesIO(data))
+
+
+def raw_frame(data):
+    # record frame before the normalization (as in fit2df)
+    df = parsefit.read_messages(io.BytesIO(data))['record'].to_frame()
+    dtmin = df['timestamp'].min()
+    df['workout_id'] = int(dtmin.strftime('%Y%m%d%H%M'))
+    df['date'] = dtmin.strftime('%Y-%m-%d')
+    df['elapsed_time'] = (df['timestamp'] - dtmin).dt.total_seconds()
+    return df
+
+
+def best_intervals(df):
+    tdf = df.rename(columns={'workout_id': 'TRAINING_ID', 'heart_rate': 'HEARTRATE'})
+    tdf = tdf.rename(columns={c: c.upper() for c in tdf.columns})
+    return bestinterval.best_intervals(tdf)
+
+
+def create_tables(database, sports):
+    for sport in sports:
+        create_table(database, sport)
+    conn = sqlite3.connect(database)
+    for summary in sportschema.summaries.values():
+        conn.execute('DROP TABLE IF EXISTS "{}"'.format(summary['table']))
+        conn.execute('CREATE TABLE "{}" ({})'.format(summary['table'],
+                                                     ', '.join('"{}"'.format(c) for c in summary['columns'])))
+    conn.commit()
+    conn.close()
+
+
+def upload(archive, sports, db):
+    stream = io.BytesIO(archive)
+    stream.filename = 'corpus.zip'
+    return parsefit.fitfile(stream, sports, db, force=True)
+
+
+def run(args):
+    parsefit.local_test = False
+    parsefit.db_test = False
+    parsefit.dump_parquet = False
+    files = corpus(args.sports, args.durations, args.intervals)
+    packages, archive = package(files)
+    if args.corpus:
+        write_corpus(args.corpus, packages, archive)
+
+    results = list()
+
+    def record(key, stage, records, timing):
+        sport, duration, interval = key
+        results.append({'sport': sport, 'duration': duration, 'interval': interval, 'records': records,
+                        'stage': stage, 'seconds': round(timing[0], 6), 'peak_mb': round(timing[1] / 2 ** 20, 3)})
+        print('{:<20} {:>6} {:>4} {:>7} {:<16} {:>9.4f} {:>9.2f}'.format(sport, duration, interval, records, stage,
+                                                                          timing[0], timing[1] / 2 ** 20))
+
+    print('{:<20} {:>6} {:>4} {:>7} {:<16} {:>9} {:>9}'.format('sport', 'dur[s]', 'iv', 'records', 'stage',
+                                                                'time[s]', 'peak[MB]'))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = {'dialect': 'sqlite', 'database': os.path.join(tmpdir, 'bench.db')}
+        create_tables(db['database'], sportschema.sports)
+        for key, data in files.items():
+            sport = key[0]
+            _, df, _ = fit2df(data)
+            n = len(df)
+            record(key, 'decompress_gz', n, measure(decompress_gz, packages[key]['gz'], repeat=args.repeat))
+            record(key, 'decompress_zip', n, measure(decompress_zip, archive, packages[key]['member'],
+                                                     repeat=args.repeat))
+            record(key, 'fit2df', n, measure(fit2df, data, repeat=args.repeat))
+            raw = raw_frame(data)
+            record(key, 'normalize', n, measure(sportschema.normalize, raw, sport, parsefit.compact_frames,
+                                                repeat=args.repeat))
+            record(key, 'save_data', n, measure(parsefit.save_data, sport, df, db, repeat=args.repeat))
+            record(key, 'bestinterval', n, measure(best_intervals, df, repeat=args.repeat))
+        total = ('all', sum(args.durations) * len(args.sports) * len(args.intervals), 0)
+        records = sum(len(fit2df(data)[1]) for data in files.values())
+        record(total, 'upload_zip', records, measure(upload, archive, args.sports, db, repeat=1))
+        hanawriter.close_pools()
+
+    return {'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'parameters': {'sports': args.sports, 'durations': args.durations, 'intervals': args.intervals,
+                           'repeat': args.repeat, 'compact_frames': parsefit.compact_frames},
+            'results': results}
+
+
+def result_key(result):
+    return (result['sport'], result['duration'], result['interval'], result['stage'])
+
+
+min_delta = 0.002  # s, smaller differences are timing noise
+
+
+def compare(report, baseline, tolerance):
+    # number of stages slower than the baseline by more than tolerance (and min_delta)
+    base = {result_key(r): r for r in baseline['results']}
+    regressions = 0
+    print('\n{:<44} {:>9} {:>9} {:>8}'.format('stage', 'base[s]', 'now[s]', 'change'))
+    for result in report['results']:
+        old = base.get(result_key(result))
+        if not old or old['seconds'] <= 0:
+            continue
+        change = result['seconds'] / old['seconds'] - 1
+        flag = ''
+        if change > tolerance and result['seconds'] - old['seconds'] > min_delta:
+            regressions += 1
+            flag = '  REGRESSION'
+        print('{:<44} {:>9.4f} {:>9.4f} {:>+7.1%}{}'.format('/'.join(str(k) for k in result_key(result)),
+                                                            old['seconds'], result['seconds'], change, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark suite of the ingest pipeline')
+    parser.add_argument('--sports', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument('--durations', nargs='+', type=int, default=[3600], help='seconds')
+    parser.add_argument('--intervals', nargs='+', type=int, default=[1], help='seconds between samples')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', default='benchmark_report.json')
+    parser.add_argument('--compare', help='earlier report')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slow down (0.2: 20%%)')
+    parser.add_argument('--corpus', help='directory for the generated .fit/.fit.gz/.zip files')
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.out, 'w') as out:
+        json.dump(report, out, indent=1)
+    print('Report: {}'.format(args.out))
+    if args.compare:
+        with open(args.compare) as inp:
+            if compare(report, json.load(inp), args.tolerance) > 0:
+                sys.exit(1)
@@ -0,0 +1,225 @@
+###
+# Synthetic FIT files for benchmarking
+# Writes minimal but valid activity files (file_id, sport, zones, events, records, laps, session)
+# that fitparse decodes like a Garmin/Wahoo export.
+###
+
+import struct
+from datetime import datetime, timezone
+
+import numpy as np
+
+FIT_EPOCH = datetime(1989, 12, 31, tzinfo=timezone.utc)
+
+CRC_TABLE = (0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+             0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400)
+
+# base type: (id, struct format, invalid value)
+BASE_TYPES = {'enum': (0x00, 'B', 0xFF),
+              'sint8': (0x01, 'b', 0x7F),
+              'uint8': (0x02, 'B', 0xFF),
+              'sint16': (0x83, 'h', 0x7FFF),
+              'uint16': (0x84, 'H', 0xFFFF),
+              'sint32': (0x85, 'i', 0x7FFFFFFF),
+              'uint32': (0x86, 'I', 0xFFFFFFFF),
+              'uint32z': (0x8C, 'I', 0)}
+
+# message name: (global message number, {field: (field number, base type, scale, offset)})
+MESSAGES = {
+    'file_id': (0, {'type': (0, 'enum', 1, 0), 'manufacturer': (1, 'uint16', 1, 0), 'product': (2, 'uint16', 1, 0),
+                    'serial_number': (3, 'uint32z', 1, 0), 'time_created': (4, 'uint32', 1, 0)}),
+    'sport': (12, {'sport': (0, 'enum', 1, 0), 'sub_sport': (1, 'enum', 1, 0)}),
+    'hr_zone': (8, {'message_index': (254, 'uint16', 1, 0), 'high_bpm': (1, 'uint8', 1, 0)}),
+    'power_zone': (9, {'message_index': (254, 'uint16', 1, 0), 'high_value': (1, 'uint16', 1, 0)}),
+    'event': (21, {'timestamp': (253, 'uint32', 1, 0), 'event': (0, 'enum', 1, 0), 'event_type': (1, 'enum', 1, 0),
+                   'data': (3, 'uint32', 1, 0), 'event_group': (4, 'uint8', 1, 0)}),
+    'record': (20, {'timestamp': (253, 'uint32', 1, 0),
+                    'position_lat': (0, 'sint32', 1, 0), 'position_long': (1, 'sint32', 1, 0),
+                    'altitude': (2, 'uint16', 5, 500), 'heart_rate': (3, 'uint8', 1, 0),
+                    'cadence': (4, 'uint8', 1, 0), 'distance': (5, 'uint32', 100, 0),
+                    'speed': (6, 'uint16', 1000, 0), 'power': (7, 'uint16', 1, 0),
+                    'grade': (9, 'sint16', 100, 0), 'temperature': (13, 'sint8', 1, 0),
+                    'left_right_balance': (30, 'uint8', 1, 0), 'gps_accuracy': (31, 'uint8', 1, 0),
+                    'enhanced_speed': (73, 'uint32', 1000, 0), 'enhanced_altitude': (78, 'uint32', 5, 500),
+                    'total_cycles': (19, 'uint32', 1, 0), 'vertical_speed': (32, 'sint16', 1000, 0),
+                    'vertical_oscillation': (39, 'uint16', 10, 0), 'stance_time_percent': (40, 'uint16', 100, 0),
+                    'stance_time': (41, 'uint16', 10, 0), 'fractional_cadence': (53, 'uint8', 128, 0)}),
+    'lap': (19, {'timestamp': (253, 'uint32', 1, 0), 'start_time': (2, 'uint32', 1, 0),
+                 'total_elapsed_time': (7, 'uint32', 1000, 0), 'total_timer_time': (8, 'uint32', 1000, 0),
+                 'total_distance': (9, 'uint32', 100, 0), 'avg_heart_rate': (15, 'uint8', 1, 0),
+                 'max_heart_rate': (16, 'uint8', 1, 0), 'avg_power': (19, 'uint16', 1, 0),
+                 'max_power': (20, 'uint16', 1, 0)}),
+    'session': (18, {'timestamp': (253, 'uint32', 1, 0), 'start_time': (2, 'uint32', 1, 0),
+                     'total_elapsed_time': (7, 'uint32', 1000, 0), 'total_timer_time': (8, 'uint32', 1000, 0),
+                     'total_distance': (9, 'uint32', 100, 0), 'avg_heart_rate': (16, 'uint8', 1, 0),
+                     'max_heart_rate': (17, 'uint8', 1, 0), 'avg_power': (20, 'uint16', 1, 0),
+                     'max_power': (21, 'uint16', 1, 0), 'num_laps': (26, 'uint16', 1, 0)}),
+}
+
+SPORT = {'generic': 0, 'running': 1, 'cycling': 2, 'swimming': 5}
+SUB_SPORT = {'generic': 0, 'treadmill': 1, 'indoor_cycling': 6, 'lap_swimming': 17, 'open_water': 18}
+EVENT_TIMER = 0
+EVENT_TYPE = {'start': 0, 'stop': 1, 'stop_all': 4}
+
+# sport: (sport, sub_sport, record fields, (speed m/s, cadence)); sport None: no sport message
+PROFILES = {
+    'cycling_outdoor': ('cycling', 'generic',
+                        ['timestamp', 'position_lat', 'position_long', 'gps_accuracy', 'enhanced_altitude', 'altitude',
+                         'distance', 'heart_rate', 'cadence', 'enhanced_speed', 'speed', 'power', 'left_right_balance',
+                         'grade', 'temperature'], (8., 88.)),
+    'cycling_indoor': ('cycling', 'indoor_cycling',
+                       ['timestamp', 'heart_rate', 'cadence', 'power', 'left_right_balance', 'temperature'], (8., 88.)),
+    'running': ('running', 'generic',
+                ['timestamp', 'position_lat', 'position_long', 'gps_accuracy', 'grade', 'vertical_speed',
+                 'enhanced_altitude', 'altitude', 'distance', 'heart_rate', 'cadence', 'fractional_cadence',
+                 'enhanced_speed', 'speed', 'vertical_oscillation', 'stance_time', 'stance_time_percent',
+                 'temperature'], (3., 85.)),
+    'swimming_pool': ('swimming', 'lap_swimming',
+                      ['timestamp', 'distance', 'total_cycles', 'heart_rate', 'cadence', 'enhanced_speed', 'speed'],
+                      (1.2, 30.)),
+    'swimming_open_water': ('swimming', 'open_water',
+                            ['timestamp', 'distance', 'position_lat', 'position_long', 'heart_rate', 'cadence',
+                             'enhanced_speed', 'speed'], (1.1, 28.)),
+    'unidentified': (None, None, ['timestamp', 'heart_rate', 'cadence', 'temperature'], (0., 60.)),
+}
+
+
+def crc16(data, crc=0):
+    for byte in data:
+        tmp = CRC_TABLE[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ CRC_TABLE[byte & 0xF]
+        tmp = CRC_TABLE[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ CRC_TABLE[(byte >> 4) & 0xF]
+    return crc
+
+
+class FitWriter:
+
+    def __init__(self):
+        self.data = bytearray()
+        self.local = {}
+
+    def define(self, local_num, name, fields):
+        mesg_num, field_defs = MESSAGES[name]
+        self.data += struct.pack('<BBBHB', 0x40 | local_num, 0, 0, mesg_num, len(fields))
+        packers = list()
+        for f in fields:
+            num, btype, scale, offset = field_defs[f]
+            base_id, fmt, invalid = BASE_TYPES[btype]
+            self.data += struct.pack('<BBB', num, struct.calcsize(fmt), base_id)
+            packers.append((scale, offset, invalid))
+        fmt = '<B' + ''.join(BASE_TYPES[field_defs[f][1]][1] for f in fields)
+        self.local[local_num] = (struct.Struct(fmt), packers)
+
+    def write(self, local_num, values):
+        packer, scales = self.local[local_num]
+        raw = [v if v is None else int(round((v + offset) * scale)) if (scale != 1 or offset) else int(v)
+               for v, (scale, offset, _) in zip(values, scales)]
+        raw = [scales[i][2] if v is None else v for i, v in enumerate(raw)]
+        self.data += packer.pack(local_num, *raw)
+
+    def getvalue(self):
+        header = struct.pack('<BBHI4s', 14, 0x10, 2093, len(self.data), b'.FIT')
+        header += struct.pack('<H', crc16(header))
+        body = header + bytes(self.data)
+        return body + struct.pack('<H', crc16(body))
+
+
+def fit_timestamp(dt):
+    return int((dt - FIT_EPOCH).total_seconds())
+
+
+def samples(duration, interval=1, seed=0, speed=8., cadence=88.):
+    # Plausible endurance data as numpy arrays (physical units), one sample per interval seconds
+    rng = np.random.default_rng(seed)
+    n = int(duration // interval)
+    t = np.arange(n) * interval
+    power = np.clip(200 + 60 * np.sin(t / 300.) + rng.normal(0, 25, n), 0, 1500)
+    hr = np.clip(135 + 20 * np.sin(t / 600.) + rng.normal(0, 3, n), 60, 220)
+    cadence = np.clip(cadence + rng.normal(0, cadence / 20., n), 0, 200)
+    speed = np.clip(speed * (1 + 0.2 * np.sin(t / 200.)) + rng.normal(0, speed / 25., n), 0, 30)
+    distance = np.cumsum(speed * interval)
+    altitude = 300 + 50 * np.sin(t / 1800.)
+    # curved route with ~1.5 m GPS noise (1 m: ~19 semicircles)
+    lat = (48.0 + distance / 111000.) * (2 ** 31 / 180.) + rng.normal(0, 30, n)
+    lon = (8.5 + 0.02 * np.sin(distance / 3000.)) * (2 ** 31 / 180.) + rng.normal(0, 30, n)
+    return {'t': t, 'power': power, 'heart_rate': hr, 'cadence': cadence, 'speed': speed, 'distance': distance,
+            'altitude': altitude, 'position_lat': lat, 'position_long': lon,
+            'total_cycles': np.cumsum(cadence * interval / 60.).astype(int),
+            'vertical_speed': np.gradient(altitude, interval) if n > 1 else np.zeros(n),
+            'fractional_cadence': rng.uniform(0, 0.99, n), 'vertical_oscillation': 85 + rng.normal(0, 3, n),
+            'stance_time': 250 + rng.normal(0, 10, n), 'stance_time_percent': 35 + rng.normal(0, 1, n)}
+
+
+def synth_fit(sport='cycling_outdoor', duration=3600, interval=1, start=None, pauses=1, seed=0, laps=True):
+    # laps: a lap message per timer segment and a session message (without: derived from the records)
+    sport_name, sub_sport, fields, (speed, cadence) = PROFILES[sport]
+    start = start or datetime(2021, 3, 22, 8, 0, tzinfo=timezone.utc)
+    ts0 = fit_timestamp(start)
+    s = samples(duration, interval, seed, speed, cadence)
+    n = len(s['t'])
+
+    w = FitWriter()
+    w.define(0, 'file_id', ['type', 'manufacturer', 'product', 'serial_number', 'time_created'])
+    w.write(0, [4, 255, 1, 12345, ts0])
+    if sport_name:
+        w.define(1, 'sport', ['sport', 'sub_sport'])
+        w.write(1, [SPORT[sport_name], SUB_SPORT[sub_sport]])
+    w.define(2, 'hr_zone', ['message_index', 'high_bpm'])
+    for i, bpm in enumerate([100, 130, 150, 165, 180]):
+        w.write(2, [i, bpm])
+    w.define(3, 'power_zone', ['message_index', 'high_value'])
+    for i, watt in enumerate([140, 190, 230, 270, 310, 380, 2000]):
+        w.write(3, [i, watt])
+    w.define(4, 'event', ['timestamp', 'event', 'event_type', 'data', 'event_group'])
+    w.define(5, 'record', fields)
+
+    # timer stop/start pairs evenly spread over the activity
+    pause_at = {int(n * (k + 1) / (pauses + 1)) for k in range(pauses)}
+    w.write(4, [ts0, EVENT_TIMER, EVENT_TYPE['start'], 0, 0])
+    for i in range(n):
+        ts = ts0 + int(s['t'][i])
+        if i in pause_at:
+            w.write(4, [ts, EVENT_TIMER, EVENT_TYPE['stop'], 0, 0])
+            w.write(4, [ts, EVENT_TIMER, EVENT_TYPE['start'], 0, 0])
+        row = list()
+        for f in fields:
+            if f == 'timestamp':
+                row.append(ts)
+            elif f in ('enhanced_speed',):
+                row.append(s['speed'][i])
+            elif f in ('enhanced_altitude',):
+                row.append(s['altitude'][i])
+            elif f == 'grade':
+                row.append(0.5)
+            elif f == 'temperature':
+                row.append(18)
+            elif f == 'left_right_balance':
+                row.append(50)
+            elif f == 'gps_accuracy':
+                row.append(3)
+            else:
+                row.append(s[f][i])
+        w.write(5, row)
+    w.write(4, [ts0 + int(s['t'][-1]), EVENT_TIMER, EVENT_TYPE['stop_all'], 0, 0])
+
+    if laps:
+        lap_fields = ['timestamp', 'start_time', 'total_elapsed_time', 'total_timer_time', 'total_distance',
+                      'avg_heart_rate', 'max_heart_rate', 'avg_power', 'max_power']
+        w.define(6, 'lap', lap_fields)
+        w.define(7, 'session', lap_fields + ['num_laps'])
+        bounds = [0] + sorted(pause_at) + [n]
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            w.write(6, lap_values(s, lo, hi, ts0, 'power' in fields))
+        w.write(7, lap_values(s, 0, n, ts0, 'power' in fields) + [len(bounds) - 1])
+    return w.getvalue()
+
+
+def lap_values(s, lo, hi, ts0, power):
+    seconds = float(s['t'][hi - 1] - s['t'][lo])
+    return [ts0 + int(s['t'][hi - 1]), ts0 + int(s['t'][lo]), seconds, seconds,
+            float(s['distance'][hi - 1] - s['distance'][lo]), s['heart_rate'][lo:hi].mean(),
+            s['heart_rate'][lo:hi].max(), s['power'][lo:hi].mean() if power else None,
+            s['power'][lo:hi].max() if power else None]
@@ -0,0 +1,224 @@
+###
+# Opt-in compaction of the records before they are written (parsefit.compaction)
+# Steps, applied in this order:
+#   bucket:   means over bucket_seconds time buckets of the timer segments (cumulative columns: last value, columns
+#             with a fill value for missing data: mean of the present values, positions: first record's)
+#   track:    GPS track simplification (Douglas-Peucker with the time-synchronized distance): positions not needed
+#             to reproduce the track within track_tolerance metres are cleared (fill value 0)
+#   collapse: rows inside a run of unchanged values (all columns but timestamp/elapsed_time, regular sampling)
+#             are dropped, the first and the last row of the run are kept
+# expand() turns compacted records back into a 1 s series: collapsed runs and buckets are held, positions
+# interpolated in time. Against the full records (benchmarks/bench_compaction.py): collapse is lossless, positions
+# within track_tolerance (with bucket plus the deviation from a straight line inside a bucket, ~2 m); with bucket
+# the mean-max values of >= 60 s and the session averages stay within 1 %, intervals shorter than a bucket and
+# the maxima are not reproduced.
+# Caveat of expand(): recording gaps inside a run of unchanged values (collapse) and GPS dropouts between kept
+# positions (track) are filled as well.
+###
+
+import numpy as np
+import pandas as pd
+
+import sportschema
+import summary
+import segments
+
+steps = ['bucket', 'track', 'collapse']
+bucket_seconds = 5
+track_tolerance = 5.  # m
+track_sports = ['cycling_outdoor', 'running', 'swimming_open_water', 'unidentified']
+cumulative = ['distance', 'total_cycles']
+# not averaged or compared
+fixed = ['workout_id', 'date', 'timestamp', 'elapsed_time', 'hr_zones', 'power_zones']
+position = ['position_lat', 'position_long']
+
+METRES_PER_DEGREE = 111195.
+SEMICIRCLE = 180. / 2 ** 31  # degrees
+
+
+def name(selected):
+    # e.g. 'bucket5s+track5m+collapse' (as stored in the COMPACTION table)
+    parts = {'bucket': 'bucket{}s'.format(bucket_seconds), 'track': 'track{:g}m'.format(track_tolerance),
+             'collapse': 'collapse'}
+    return '+'.join(parts[step] for step in steps if step in selected)
+
+
+def seconds(df):
+    return df['timestamp'].to_numpy().astype('datetime64[s]').astype(np.int64)
+
+
+def unchanged(df):
+    # per record from the second on: all columns but the fixed ones equal to the previous record
+    same = np.ones(max(len(df) - 1, 0), dtype=bool)
+    for col in df.columns:
+        if col in fixed:
+            continue
+        values = df[col]
+        values = values.cat.codes.to_numpy() if isinstance(values.dtype, pd.CategoricalDtype) else values.to_numpy()
+        same &= values[1:] == values[:-1]
+    return same
+
+
+def bucket(df):
+    segment = segments.ids(df)
+    key = np.floor(df['elapsed_time'].to_numpy(dtype=np.float64) / bucket_seconds)
+    first = np.ones(len(df), dtype=bool)
+    first[1:] = (segment[1:] != segment[:-1]) | (key[1:] != key[:-1])
+    starts = np.flatnonzero(first)
+    ends = np.append(starts[1:], len(df)) - 1
+    out = df.iloc[starts].reset_index(drop=True)
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if col in fixed or col in position or values.dtype.kind not in 'iuf':
+            continue
+        if col in cumulative:
+            out[col] = values[ends]
+            continue
+        fill = sportschema.columns.get(col, (None, 0))[1]
+        present = values != fill
+        counts = np.add.reduceat(present, starts)
+        sums = np.add.reduceat(np.where(present, values, 0).astype(np.float64), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts > 0, sums / counts, fill)
+        out[col] = (np.round(means) if values.dtype.kind in 'iu' else means).astype(values.dtype)
+    return out
+
+
+def simplify(t, x, y, tolerance):
+    # Douglas-Peucker with the time-synchronized distance: a point is kept if its distance to the position
+    # interpolated in time between the kept points around it exceeds tolerance. Returns the keep mask.
+    n = len(t)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        ratio = (t[a + 1:b] - t[a]) / (t[b] - t[a]) if t[b] > t[a] else np.zeros(b - a - 1)
+        distance = np.hypot(x[a + 1:b] - (x[a] + ratio * (x[b] - x[a])), y[a + 1:b] - (y[a] + ratio * (y[b] - y[a])))
+        i = int(np.argmax(distance))
+        if distance[i] > tolerance:
+            k = a + 1 + i
+            keep[k] = True
+            stack += [(a, k), (k, b)]
+    return keep
+
+
+def metres(lat, long):
+    # semicircles -> local metres (equirectangular)
+    lat_deg = lat * SEMICIRCLE
+    y = lat_deg * METRES_PER_DEGREE
+    x = long * SEMICIRCLE * METRES_PER_DEGREE * np.cos(np.radians(np.median(lat_deg)))
+    return x, y
+
+
+def track(df):
+    if not set(position) <= set(df.columns):
+        return df
+    lat = df['position_lat'].to_numpy()
+    long = df['position_long'].to_numpy()
+    valid = np.flatnonzero((lat != 0) | (long != 0))
+    if len(valid) < 3:
+        return df
+    x, y = metres(lat[valid].astype(np.float64), long[valid].astype(np.float64))
+    keep = simplify(seconds(df)[valid].astype(np.float64), x, y, track_tolerance)
+    cleared = valid[~keep]
+    df = df.copy()
+    for col in position:
+        values = df[col].to_numpy().copy()
+        values[cleared] = 0
+        df[col] = values
+    return df
+
+
+def collapse(df, step):
+    # drops the inner records of runs of unchanged values sampled every step seconds
+    if len(df) < 3:
+        return df
+    segment = segments.ids(df)
+    same = unchanged(df) & (np.diff(seconds(df)) == step) & (segment[1:] == segment[:-1])
+    inner = np.zeros(len(df), dtype=bool)
+    inner[1:-1] = same[:-1] & same[1:]
+    return df[~inner].reset_index(drop=True)
+
+
+def positions(df):
+    if 'position_lat' not in df.columns:
+        return 0
+    return int(((df['position_lat'].to_numpy() != 0) | (df['position_long'].to_numpy() != 0)).sum())
+
+
+def compact(df, sport, selected):
+    # compacted records (table columns and dtypes unchanged) and the counts of the reduction
+    stats = {'records': len(df), 'positions': positions(df)}
+    if 'bucket' in selected:
+        df = bucket(df)
+    if 'track' in selected and sport in track_sports:
+        df = track(df)
+    if 'collapse' in selected:
+        df = collapse(df, bucket_seconds if 'bucket' in selected else 1)
+    stats.update(kept_records=len(df), kept_positions=positions(df))
+    return df, stats
+
+
+def report(df, sport, stats, selected):
+    # COMPACTION row of the workout
+    row = pd.DataFrame([dict(stats, steps=name(selected),
+                             ratio=stats['records'] / stats['kept_records'] if stats['kept_records'] else 0.)])
+    return summary.finish(row, df.iloc[0], sport, 'compaction')
+
+
+def repeat(df, counts, step):
+    # every record counts times, step seconds apart
+    index = np.repeat(np.arange(len(df)), counts)
+    offset = np.arange(len(index)) - np.repeat(np.cumsum(counts) - counts, counts)
+    out = df.iloc[index].reset_index(drop=True)
+    out['timestamp'] = out['timestamp'] + pd.to_timedelta(offset * step, unit='s')
+    out['elapsed_time'] = (out['elapsed_time'] + offset * step).astype(df['elapsed_time'].dtype)
+    return out
+
+
+def expand(df, selected):
+    # 1 s series of compacted records (for analyses counting records as seconds, e.g. utils.bestinterval)
+    if len(df) == 0:
+        return df
+    df = df.sort_values('timestamp', kind='stable', ignore_index=True)
+    held = np.zeros(len(df), dtype=bool)  # positions held in a bucket
+    if 'collapse' in selected:
+        step = bucket_seconds if 'bucket' in selected else 1
+        segment = segments.ids(df)
+        gap = np.diff(seconds(df))
+        run = unchanged(df) & (segment[1:] == segment[:-1]) & (gap > step) & (gap % step == 0)
+        counts = np.ones(len(df), dtype=np.int64)
+        counts[:-1][run] = gap[run] // step
+        df = repeat(df, counts, step)
+    if 'bucket' in selected:
+        segment = segments.ids(df)
+        counts = np.full(len(df), bucket_seconds, dtype=np.int64)
+        inner = segment[1:] == segment[:-1]
+        counts[:-1][inner] = np.clip(np.diff(seconds(df))[inner], 1, bucket_seconds)
+        df = repeat(df, counts, 1)
+        held = np.ones(len(df), dtype=bool)
+        held[np.cumsum(counts) - counts] = False
+    if ('track' in selected or 'bucket' in selected) and set(position) <= set(df.columns):
+        t = seconds(df)
+        lat = df['position_lat'].to_numpy()
+        long = df['position_long'].to_numpy()
+        valid = ((lat != 0) | (long != 0)) & ~held
+        if valid.sum() >= 2:
+            kept = np.flatnonzero(valid)
+            missing = np.flatnonzero(~valid & (held | ((t > t[kept[0]]) & (t < t[kept[-1]]))))
+            tail = missing[t[missing] > t[kept[-1]]]  # held in the last bucket: extrapolated
+            a, b = kept[-2], kept[-1]
+            df = df.copy()
+            for col, values in zip(position, [lat, long]):
+                filled = values.copy()
+                filled[missing] = np.round(np.interp(t[missing], t[kept], values[kept].astype(np.float64)))
+                if len(tail) and t[b] > t[a]:
+                    slope = (float(values[b]) - float(values[a])) / (t[b] - t[a])
+                    filled[tail] = np.round(values[b] + slope * (t[tail] - t[b]))
+                df[col] = filled
+    return df
@@ -0,0 +1,115 @@
+###
+# Local columnar dump of the parsed workouts (offline analysis)
+# Parquet, partitioned by sport and year/month (hive layout), one file per workout:
+#   <root>/sport=<sport>/year=<YYYY>/month=<M>/<workout_id>.parquet
+# The file is written under a hidden temporary name and renamed, so readers never see a partial file and a
+# re-imported workout replaces its file. Long workouts are written chunk by chunk (Writer: a row group per chunk).
+# read() loads only the requested columns (of the schema unified over all files, missing columns are null); filters
+# on workout_id/date use the row group statistics, date filters additionally prune the year/month partitions.
+# Needs pyarrow.
+###
+
+import os
+import logging
+import tempfile
+
+
+def workout_path(root, sport, df):
+    workout_id = int(df['workout_id'].iat[0])
+    date = str(df['date'].iat[0])
+    return os.path.join(root, 'sport={}'.format(sport), 'year={}'.format(int(date[:4])),
+                        'month={}'.format(int(date[5:7])), '{}.parquet'.format(workout_id))
+
+
+class Writer:
+    # one workout written chunk by chunk (a row group per chunk), renamed into place when the block ends without error
+    #   with Writer(root, sport) as dump: dump.write(df) ...
+
+    def __init__(self, root, sport):
+        self.root = root
+        self.sport = sport
+        self.path = None
+        self.tmp = None
+        self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if len(df) == 0:
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.path = workout_path(self.root, self.sport, df)
+            directory = os.path.dirname(self.path)
+            os.makedirs(directory, exist_ok=True)
+            # files starting with '.' are ignored by the dataset readers
+            fd, self.tmp = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+            os.close(fd)
+            self.writer = pq.ParquetWriter(self.tmp, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:
+            return None
+        self.writer.close()
+        self.writer = None
+        os.replace(self.tmp, self.path)
+        logging.info('Dumped workout to: {}'.format(self.path))
+        return self.path
+
+    def abort(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
+        os.remove(self.tmp)
+
+
+def write(root, sport, df):
+    with Writer(root, sport) as dump:
+        dump.write(df)
+    return dump.path
+
+
+def partition_filters(filters):
+    # year/month partition filters implied by the date filters ('YYYY-MM-DD' strings)
+    partitions = list()
+    for col, op, value in filters:
+        if col != 'date' or op not in ('==', '=', '>', '>=', '<', '<='):
+            continue
+        year, month = int(value[:4]), int(value[5:7])
+        if op in ('==', '='):
+            partitions += [('year', '==', year), ('month', '==', month)]
+        else:
+            partitions.append(('year', op if op.endswith('=') else op + '=', year))
+    return partitions
+
+
+def read(root, sport=None, columns=None, filters=None):
+    # columns: projection (None: all, columns the dump does not have are left out)
+    # filters: [(column, op, value)], e.g. [('date', '>=', '2021-01-01'), ('workout_id', '==', 202103220800)]
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    path = os.path.join(root, 'sport={}'.format(sport)) if sport else root
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    # the schema of the first file only: the sports (and dumps of older versions) differ in their columns
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+    if schemas:
+        schema = pa.unify_schemas([dataset.schema] + schemas, promote_options='permissive')
+        dataset = ds.dataset(path, schema=schema, format='parquet', partitioning='hive')
+    if columns is not None:
+        columns = [col for col in columns if col in dataset.schema.names]
+    filters = list(filters or [])
+    filters += partition_filters(filters)
+    expression = pq.filters_to_expression(filters) if filters else None
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
@@ -0,0 +1,303 @@
+###
+# Writing the parsed data to HANA
+# Connections are pooled across files and uploads, idle ones are checked before reuse (check_idle_seconds).
+# The rows of a frame are sent in chunks with a commit every 'commit_chunks' chunks; a failed chunk is retried on
+# a new connection together with the not yet committed chunks before it. The DB-API backend is exchangeable:
+# db['dialect'] = 'sqlite' with db['database'] writes to a local sqlite3 stand-in (testing and benchmarks
+# without HANA).
+###
+
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+chunk_size = 10000  # rows per executemany
+commit_chunks = 5  # chunks per commit
+max_retries = 2
+pool_size = 4  # idle connections kept per database
+check_idle_seconds = 30  # connections idle longer are checked (ping) before reuse
+
+stats_lock = threading.Lock()
+stats = {'rows': 0, 'bytes': 0, 'round_trips': 0, 'chunks': 0, 'commits': 0, 'connects': 0, 'retries': 0,
+         'seconds': 0.}
+
+
+def count(**kwargs):
+    with stats_lock:
+        for key, value in kwargs.items():
+            stats[key] += value
+
+
+def throughput():
+    with stats_lock:
+        snapshot = dict(stats)
+    snapshot['rows_per_s'] = snapshot['rows'] / snapshot['seconds'] if snapshot['seconds'] > 0 else 0.
+    snapshot['bytes_per_s'] = snapshot['bytes'] / snapshot['seconds'] if snapshot['seconds'] > 0 else 0.
+    return snapshot
+
+
+def reset_stats():
+    with stats_lock:
+        for key in stats:
+            stats[key] = 0
+
+
+####### CONNECTIONS
+def hana_connect(db):
+    from hdbcli import dbapi
+    return dbapi.connect(address=db['host'], port=db['port'], user=db['user'], password=db['pwd'], encrypt=True,
+                         sslValidateCertificate=False)
+
+
+def sqlite_connect(db):
+    import sqlite3
+    sqlite3.register_adapter(pd.Timestamp, str)
+    return sqlite3.connect(db['database'], check_same_thread=False)
+
+
+dialects = {'hana': {'connect': hana_connect,
+                     'table': '"{schema}"."{table}"',
+                     'upsert': 'UPSERT {table} VALUES({values}) WITH PRIMARY KEY',
+                     'ping': 'SELECT 1 FROM DUMMY'},
+            'sqlite': {'connect': sqlite_connect,
+                       'table': '"{table}"',
+                       'upsert': 'INSERT OR REPLACE INTO {table} VALUES({values})',
+                       'ping': 'SELECT 1'}}
+
+
+def table_name(db, table):
+    return dialects[db.get('dialect', 'hana')]['table'].format(schema=db.get('schema'), table=table)
+
+
+class ConnectionPool:
+
+    def __init__(self, db, size=None):
+        self.db = db
+        self.dialect = dialects[db.get('dialect', 'hana')]
+        self.idle = queue.LifoQueue(maxsize=size or pool_size)
+
+    def acquire(self):
+        # idle connection (checked if idle for long: the server may have dropped it), else a new one
+        while True:
+            try:
+                conn, released = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if time.monotonic() - released < check_idle_seconds or self.alive(conn):
+                return conn
+            logging.info('Discarding stale db connection')
+            self.discard(conn)
+        count(connects=1)
+        with metrics.timer('db.connect'):
+            conn = self.dialect['connect'](self.db)
+        if hasattr(conn, 'setautocommit'):
+            conn.setautocommit(False)
+        return conn
+
+    def alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.dialect['ping'])
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception as e:
+            logging.debug('Connection check failed: {}'.format(e))
+            return False
+
+    def release(self, conn):
+        try:
+            self.idle.put_nowait((conn, time.monotonic()))
+        except queue.Full:
+            self.discard(conn)
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logging.debug('Closing connection failed: {}'.format(e))
+
+    def close(self):
+        while not self.idle.empty():
+            self.discard(self.idle.get_nowait()[0])
+
+
+pools_lock = threading.Lock()
+pools = dict()
+
+
+def get_pool(db):
+    key = (db.get('dialect', 'hana'), db.get('host'), db.get('port'), db.get('user'), db.get('database'))
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(db)
+        return pools[key]
+
+
+def close_pools():
+    with pools_lock:
+        for pool in pools.values():
+            pool.close()
+        pools.clear()
+
+
+####### WRITER
+def float32_values(values):
+    # float32 -> python floats rounded to 7 significant digits: the decimal values parsed from FIT come back
+    # unchanged (8.123, not 8.1230001449585)
+    values = values.astype(np.float64)
+    magnitude = np.abs(values)
+    exponent = np.floor(np.log10(np.where((magnitude > 0) & np.isfinite(magnitude), magnitude, 1.)))
+    scale = 10. ** (6 - exponent)
+    return (np.round(values * scale) / scale).tolist()
+
+
+def column_values(series):
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return series.astype(object).tolist()
+    if dtype.kind == 'M':
+        return list(series)
+    if dtype == np.float32:
+        return float32_values(series.to_numpy())
+    return series.to_numpy().tolist()
+
+
+def rows_of(df):
+    # row tuples of python values, built column-wise (no object copy of the whole frame)
+    return list(zip(*[column_values(df[col]) for col in df.columns]))
+
+
+class Writer:
+
+    def __init__(self, db, chunk_rows=None, commit_every=None):
+        self.db = db
+        self.pool = get_pool(db)
+        self.chunk_rows = chunk_rows or chunk_size
+        self.commit_every = commit_every or commit_chunks
+        self.conn = None
+        self.row_bytes = 0
+
+    def __enter__(self):
+        self.conn = self.pool.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.pool.release(self.conn)
+        else:
+            self.pool.discard(self.conn)
+        self.conn = None
+
+    def upsert_sql(self, table, num_columns):
+        return self.pool.dialect['upsert'].format(table=table_name(self.db, table),
+                                                  values=','.join(['?'] * num_columns))
+
+    def send(self, sql, todo, pending, commit):
+        # executes todo (and commits). After an error all not committed chunks are resent on a new connection.
+        for attempt in range(max_retries + 1):
+            try:
+                cursor = self.conn.cursor()
+                for rows in todo:
+                    with metrics.timer('db.executemany') as timer:
+                        cursor.executemany(sql, rows)
+                        timer.rows = len(rows)
+                        timer.bytes = len(rows) * self.row_bytes
+                    count(round_trips=1)
+                cursor.close()
+                if commit:
+                    with metrics.timer('db.commit'):
+                        self.conn.commit()
+                    count(round_trips=1, commits=1)
+                return
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                logging.warning('Writing chunk failed ({}), retry {}/{}'.format(e, attempt + 1, max_retries))
+                count(retries=1)
+                self.pool.discard(self.conn)
+                self.conn = self.pool.acquire()
+                todo = pending
+
+    def upsert(self, table, df, columns=None):
+        columns = columns or list(df.columns)
+        sql = self.upsert_sql(table, len(columns))
+        df = df[columns]
+        start_time = time.perf_counter()
+        self.row_bytes = df.memory_usage(index=False, deep=True).sum() / len(df) if len(df) > 0 else 0
+        pending = list()
+        for start in range(0, len(df), self.chunk_rows):
+            chunk = df.iloc[start:start + self.chunk_rows]
+            rows = rows_of(chunk)
+            pending.append(rows)
+            commit = len(pending) >= self.commit_every or start + self.chunk_rows >= len(df)
+            self.send(sql, [rows], pending, commit)
+            count(rows=len(rows), chunks=1, bytes=int(self.row_bytes * len(rows)))
+            if commit:
+                pending = list()
+        count(seconds=time.perf_counter() - start_time)
+        return len(df)
+
+
+def upsert(db, table, df, columns=None):
+    with Writer(db) as writer:
+        return writer.upsert(table, df, columns)
+
+
+####### ARCHIVE BATCHES
+batch_rows = 200000  # flush a table buffer at this number of rows
+batch_bytes = 64 * 2 ** 20  # .. or at this size (pandas memory)
+
+
+class Batcher:
+    # Collects the frames of several files per target table and writes them in large batches.
+    # Flushes a table when its buffer reaches batch_rows or batch_bytes, and all tables on flush()/exit.
+
+    def __init__(self, db, max_rows=None, max_bytes=None):
+        self.db = db
+        self.max_rows = max_rows or batch_rows
+        self.max_bytes = max_bytes or batch_bytes
+        self.buffers = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, table, df, columns):
+        buffer = self.buffers.setdefault(table, {'columns': columns, 'frames': list(), 'rows': 0, 'bytes': 0})
+        if buffer['columns'] != columns:
+            raise ValueError('Columns differ from buffered data of table {}'.format(table))
+        df = df[columns]
+        buffer['frames'].append(df)
+        buffer['rows'] += len(df)
+        buffer['bytes'] += int(df.memory_usage(index=False, deep=True).sum())
+        if buffer['rows'] >= self.max_rows or buffer['bytes'] >= self.max_bytes:
+            self.flush(table)
+
+    def flush(self, table=None):
+        # all tables are written before the first error is raised: a failing (e.g. missing) summary table does not
+        # cost the data of the other tables
+        error = None
+        for name in [table] if table else list(self.buffers):
+            buffer = self.buffers.pop(name, None)
+            if not buffer or not buffer['frames']:
+                continue
+            logging.info('Writing batch to: {} ({} rows of {} files)'.format(name, buffer['rows'],
+                                                                             len(buffer['frames'])))
+            df = pd.concat(buffer['frames'], ignore_index=True)
+            try:
+                upsert(self.db, name, df, buffer['columns'])
+            except Exception as e:
+                logging.error('Writing batch to {} failed: {}'.format(name, e))
+                error = error or e
+        if error is not None:
+            raise error
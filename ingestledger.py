@@ -0,0 +1,81 @@
+###
+# Ledger of the imported FIT files
+# Keyed by the sha256 of the uncompressed FIT bytes and by the workout_id. The entries are loaded once per
+# upload; new entries are written at the end of the upload, after its data. With parsefit.db_test the entries go
+# to INGEST_LEDGER_TEST, beside the test copies of the data tables.
+# HANA table created by migrate.py (sqlite stand-in: created on the fly):
+#   CREATE COLUMN TABLE INGEST_LEDGER (FIT_HASH NVARCHAR(64) PRIMARY KEY, WORKOUT_ID BIGINT, SPORT NVARCHAR(25),
+#                                      FILENAME NVARCHAR(256), NUM_RECORDS INTEGER, IMPORTED_AT LONGDATE)
+###
+
+import hashlib
+import logging
+from datetime import datetime
+
+import pandas as pd
+
+import hanawriter
+
+ledger_table = 'INGEST_LEDGER'
+columns = ['FIT_HASH', 'WORKOUT_ID', 'SPORT', 'FILENAME', 'NUM_RECORDS', 'IMPORTED_AT']
+key = ['FIT_HASH']
+sql_types = {'FIT_HASH': 'NVARCHAR(64)', 'WORKOUT_ID': 'BIGINT', 'SPORT': 'NVARCHAR(25)', 'FILENAME': 'NVARCHAR(256)',
+             'NUM_RECORDS': 'INTEGER', 'IMPORTED_AT': 'LONGDATE'}
+
+
+def new_hash():
+    # hash of the FIT data, updated chunk-wise while decompressing
+    return hashlib.sha256()
+
+
+class Ledger:
+
+    def __init__(self, db, table=None):
+        self.db = db
+        self.table = table or ledger_table
+        self.hashes = set()
+        self.workouts = set()
+        self.entries = list()
+        self.enabled = True
+        self.load()
+
+    def load(self):
+        pool = hanawriter.get_pool(self.db)
+        conn = None
+        try:
+            conn = pool.acquire()
+            cursor = conn.cursor()
+            if self.db.get('dialect') == 'sqlite':
+                cursor.execute('CREATE TABLE IF NOT EXISTS "{}" ("FIT_HASH" TEXT PRIMARY KEY, "WORKOUT_ID" INTEGER, '
+                               '"SPORT" TEXT, "FILENAME" TEXT, "NUM_RECORDS" INTEGER, "IMPORTED_AT" TEXT)'
+                               .format(self.table))
+            cursor.execute('SELECT "FIT_HASH", "WORKOUT_ID" FROM {}'.format(hanawriter.table_name(self.db, self.table)))
+            for digest, workout_id in cursor.fetchall():
+                self.hashes.add(digest)
+                self.workouts.add(workout_id)
+            cursor.close()
+            pool.release(conn)
+        except Exception as e:
+            logging.warning('Ingest ledger not available, all files are imported: {}'.format(e))
+            self.enabled = False
+            if conn is not None:
+                pool.discard(conn)
+        logging.info('Ingest ledger: {} files, {} workouts'.format(len(self.hashes), len(self.workouts)))
+
+    def known_hashes(self):
+        return frozenset(self.hashes) if self.enabled else frozenset()
+
+    def has_workout(self, workout_id):
+        return self.enabled and int(workout_id) in self.workouts
+
+    def add(self, digest, workout_id, sport, filename, num_records):
+        self.hashes.add(digest)
+        self.workouts.add(int(workout_id))
+        self.entries.append([digest, int(workout_id), sport, filename, int(num_records),
+                             datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
+
+    def flush(self):
+        if not self.enabled or not self.entries:
+            return
+        hanawriter.upsert(self.db, self.table, pd.DataFrame(self.entries, columns=columns), columns)
+        self.entries = list()
@@ -0,0 +1,110 @@
+###
+# Background processing of uploads
+# An upload is spooled to disk and queued, a fixed number of worker threads processes the queue.
+# The queue is bounded: when it is full, new uploads are rejected (QueueFull).
+###
+
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+job_workers = 1  # uploads processed at the same time
+max_queued = 4  # uploads waiting
+max_finished = 100  # finished jobs kept for status requests
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+
+    def __init__(self, run, workers=None, maxsize=None, spool_dir=None):
+        # run(path, filename, progress, **kwargs) processes one upload and returns its result
+        self.run = run
+        self.workers = workers or job_workers
+        self.queue = queue.Queue(maxsize=maxsize or max_queued)
+        self.spool_dir = spool_dir
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.threads = list()
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, name='upload-{}'.format(len(self.threads)), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, stream, filename, **kwargs):
+        self.start()
+        job_id = uuid.uuid4().hex
+        spool = tempfile.NamedTemporaryFile(delete=False, dir=self.spool_dir, prefix='upload_',
+                                            suffix=os.path.splitext(filename)[1])
+        with spool:
+            shutil.copyfileobj(stream, spool)
+        job = {'id': job_id, 'state': 'queued', 'filename': filename, 'submitted': now(), 'started': None,
+               'finished': None, 'current': None, 'result': None, 'error': None}
+        with self.lock:
+            self.jobs[job_id] = job
+        try:
+            self.queue.put_nowait((job_id, spool.name, kwargs))
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job_id]
+            os.remove(spool.name)
+            raise QueueFull('Upload queue is full ({} waiting)'.format(self.queue.maxsize))
+        logging.info('Upload queued: {} ({})'.format(job_id, filename))
+        return job_id
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job, result=dict(job['result']) if job['result'] else None)
+
+    def states(self):
+        # number of kept jobs per state
+        with self.lock:
+            states = dict.fromkeys(['queued', 'running', 'done', 'failed'], 0)
+            for job in self.jobs.values():
+                states[job['state']] += 1
+            return states
+
+    def update(self, job_id, **kwargs):
+        with self.lock:
+            self.jobs[job_id].update(kwargs)
+
+    def work(self):
+        while True:
+            job_id, path, kwargs = self.queue.get()
+            self.update(job_id, state='running', started=now())
+
+            def progress(fit_file, result):
+                self.update(job_id, current=fit_file, result=dict(result, errors=list(result['errors'])))
+
+            try:
+                result = self.run(path, self.status(job_id)['filename'], progress, **kwargs)
+                self.update(job_id, state='done', finished=now(), current=None, result=result)
+            except Exception as e:
+                logging.exception('Upload {} failed'.format(job_id))
+                self.update(job_id, state='failed', finished=now(), error=str(e))
+            finally:
+                os.remove(path)
+                self.queue.task_done()
+                self.prune()
+
+    def prune(self):
+        with self.lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job['state'] in ('done', 'failed')]
+            for job_id in finished[:max(0, len(finished) - max_finished)]:
+                del self.jobs[job_id]
+
+
+def now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
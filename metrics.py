@@ -0,0 +1,102 @@
+###
+# Timers and counters of the ingest stages
+# Per stage: calls, seconds, rows and bytes, summed process-wide (exposition() for /metrics) and into the
+# breakdowns captured by the current thread (capture(), e.g. per upload). Worker processes return their
+# captured breakdown with the result, merge() adds it in the parent.
+###
+
+import threading
+import time
+from contextlib import contextmanager
+
+fields = ['calls', 'seconds', 'rows', 'bytes']
+
+lock = threading.Lock()
+stages = dict()  # stage: {'calls', 'seconds', 'rows', 'bytes'}
+local = threading.local()
+
+
+def add(target, stage, calls=0, seconds=0., rows=0, bytes=0):
+    entry = target.setdefault(stage, dict.fromkeys(fields, 0))
+    entry['calls'] += calls
+    entry['seconds'] += seconds
+    entry['rows'] += rows
+    entry['bytes'] += bytes
+
+
+def record(stage, calls=1, seconds=0., rows=0, bytes=0):
+    with lock:
+        add(stages, stage, calls, seconds, rows, bytes)
+        for breakdown in getattr(local, 'captures', ()):
+            add(breakdown, stage, calls, seconds, rows, bytes)
+
+
+def merge(breakdown):
+    for stage, entry in breakdown.items():
+        record(stage, **entry)
+
+
+class Timer:
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+
+
+@contextmanager
+def timer(stage):
+    # with timer('normalize') as t: ...; t.rows = len(df)
+    t = Timer()
+    start = time.perf_counter()
+    try:
+        yield t
+    finally:
+        record(stage, 1, time.perf_counter() - start, int(t.rows), int(t.bytes))
+
+
+@contextmanager
+def capture(breakdown=None):
+    # stages recorded by this thread inside the block are also added to breakdown (once per breakdown)
+    breakdown = dict() if breakdown is None else breakdown
+    captures = local.__dict__.setdefault('captures', list())
+    nested = any(c is breakdown for c in captures)
+    if not nested:
+        captures.append(breakdown)
+    try:
+        yield breakdown
+    finally:
+        if not nested:
+            captures.remove(breakdown)
+
+
+def summary(breakdown):
+    # breakdown for logs and job results, slowest stage first
+    with lock:
+        items = sorted(breakdown.items(), key=lambda item: -item[1]['seconds'])
+        return {stage: dict(entry, seconds=round(entry['seconds'], 4)) for stage, entry in items}
+
+
+def snapshot():
+    with lock:
+        return {stage: dict(entry) for stage, entry in stages.items()}
+
+
+def reset():
+    with lock:
+        stages.clear()
+
+
+def exposition(prefix='g2h'):
+    # Prometheus text format
+    lines = list()
+    data = snapshot()
+    for field, kind, help in [('calls', 'counter', 'Calls per ingest stage'),
+                              ('seconds', 'counter', 'Time spent per ingest stage'),
+                              ('rows', 'counter', 'Rows processed per ingest stage'),
+                              ('bytes', 'counter', 'Bytes processed per ingest stage')]:
+        name = '{}_stage_{}_total'.format(prefix, field)
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for stage in sorted(data):
+            lines.append('{}{{stage="{}"}} {}'.format(name, stage, data[stage][field]))
+    return '\n'.join(lines) + '\n'
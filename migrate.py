@@ -0,0 +1,125 @@
+###
+# Schema migration of the summary tables (sportschema.summaries) and the ingest ledger (ingestledger)
+# Missing tables are created. Rows are written by position (hanawriter upsert), so a table whose columns differ from
+# the definition (e.g. LAP_SUMMARY before MOVING_TIME) is rebuilt in table order: created under a temporary name,
+# its rows copied (new columns NULL), the old table dropped and the new one renamed. Tables with columns the
+# definition does not have are left alone (reported). Running it again changes nothing.
+#
+# python migrate.py [--config config.yaml] [--sqlite db] [--test] [--print]
+###
+
+import sys
+import logging
+import argparse
+
+import sportschema
+import ingestledger
+import hanawriter
+
+dialects = {'hana': {'create': 'CREATE COLUMN TABLE {table} ({columns}, PRIMARY KEY ({key}))',
+                     'columns': 'SELECT COLUMN_NAME FROM SYS.TABLE_COLUMNS WHERE SCHEMA_NAME = ? AND TABLE_NAME = ? '
+                                'ORDER BY POSITION',
+                     'rename': 'RENAME TABLE {table} TO "{name}"'},
+            'sqlite': {'create': 'CREATE TABLE {table} ({columns}, PRIMARY KEY ({key}))',
+                       'columns': 'SELECT name FROM pragma_table_info(?) ORDER BY cid',
+                       'rename': 'ALTER TABLE {table} RENAME TO "{name}"'}}
+sqlite_types = {'BIGINT': 'INTEGER', 'INTEGER': 'INTEGER', 'DOUBLE': 'REAL'}  # others: TEXT
+suffix = '_MIGRATE'  # temporary name of a rebuilt table
+
+
+def definitions(test=False):
+    # (table, columns, SQL types, primary key) of the tables, column names upper case as in HANA
+    tables = list()
+    for summary in sportschema.summaries.values():
+        columns = [col.upper() for col in summary['columns']]
+        types = {col.upper(): sportschema.sql_types.get(col, 'DOUBLE') for col in summary['columns']}
+        tables.append((summary['table'], columns, types, [col.upper() for col in summary['key']]))
+    tables.append((ingestledger.ledger_table, ingestledger.columns, ingestledger.sql_types, ingestledger.key))
+    return [(table + '_TEST' if test else table, columns, types, key) for table, columns, types, key in tables]
+
+
+def column_type(db, sql_type):
+    if db.get('dialect', 'hana') == 'sqlite':
+        return sqlite_types.get(sql_type, 'TEXT')
+    return sql_type
+
+
+def create_sql(db, table, columns, types, key):
+    return dialects[db.get('dialect', 'hana')]['create'].format(
+        table=hanawriter.table_name(db, table),
+        columns=', '.join('"{}" {}'.format(col, column_type(db, types[col])) for col in columns),
+        key=', '.join('"{}"'.format(col) for col in key))
+
+
+def statements(db, table, columns, types, key, existing):
+    # statements bringing the table with the existing columns (table order, [] if missing) to the definition
+    if not existing:
+        return [create_sql(db, table, columns, types, key)]
+    existing = [col.upper() for col in existing]
+    if existing == columns:
+        return list()
+    unknown = [col for col in existing if col not in columns]
+    if unknown:
+        logging.warning('{}: columns {} not defined, table not migrated'.format(table, ', '.join(unknown)))
+        return list()
+    copied = ', '.join('"{}"'.format(col) for col in columns if col in existing)
+    name = hanawriter.table_name(db, table)
+    temporary = hanawriter.table_name(db, table + suffix)
+    return [create_sql(db, table + suffix, columns, types, key),
+            'INSERT INTO {} ({}) SELECT {} FROM {}'.format(temporary, copied, copied, name),
+            'DROP TABLE {}'.format(name),
+            dialects[db.get('dialect', 'hana')]['rename'].format(table=temporary, name=table)]
+
+
+def table_columns(cursor, db, table):
+    params = (table,) if db.get('dialect', 'hana') == 'sqlite' else (db.get('schema'), table)
+    cursor.execute(dialects[db.get('dialect', 'hana')]['columns'], params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def migrate(db, test=False, execute=True):
+    # returns the statements (executed unless execute=False)
+    pool = hanawriter.get_pool(db)
+    conn = pool.acquire()
+    done = list()
+    try:
+        cursor = conn.cursor()
+        for table, columns, types, key in definitions(test):
+            for sql in statements(db, table, columns, types, key, table_columns(cursor, db, table)):
+                if execute:
+                    logging.info('Migrate {}: {}'.format(table, sql))
+                    cursor.execute(sql)
+                done.append(sql)
+        cursor.close()
+        conn.commit()
+    except Exception:
+        pool.discard(conn)
+        raise
+    pool.release(conn)
+    return done
+
+
+def main(argv=None):
+    from backfill import db_config
+    parser = argparse.ArgumentParser(description='Creates/migrates the summary tables and the ingest ledger')
+    parser.add_argument('--config', default='config.yaml', help='HANA connection (as the app)')
+    parser.add_argument('--sqlite', help='migrate this sqlite database instead of HANA')
+    parser.add_argument('--test', action='store_true', help='the _TEST tables (parsefit.db_test)')
+    parser.add_argument('--print', action='store_true', help='print the statements only')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    db = {'dialect': 'sqlite', 'database': args.sqlite} if args.sqlite else db_config(args.config)
+    try:
+        done = migrate(db, args.test, execute=not args.print)
+    finally:
+        hanawriter.close_pools()
+    if args.print:
+        for sql in done:
+            print(sql + ';')
+    print('{} statements {}'.format(len(done), 'to execute' if args.print else 'executed') if done else
+          'Tables up to date')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
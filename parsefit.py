@@ -1,7 +1,8 @@
 ###
 # Parsing fit-files from GARMIN
 # WARNING: Only zip-format supported as input
-#
+# Command line (directory trees, resumable): backfill.py
+# Logging is configured by the entry points (app.py, backfill.py), not on import
 ###
 
 
@@ -9,129 +10,255 @@ from os import path, listdir
 import io
 import zipfile
 import gzip
+import zlib
+import tempfile
 import logging
-from datetime import datetime
+import signal
+import multiprocessing
+from array import array
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
-import yaml
+import numpy as np
 import pandas as pd
 from fitparse import FitFile, FitParseError
-from hdbcli import dbapi
 
-log_file = path.join('log/',"g2h_" + datetime.now().strftime("%Y%m%d_%H%M"))
-logging.basicConfig(level=logging.INFO,handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ])
+import sportschema
+import hanawriter
+import ingestledger
+import summary
+import dumpstore
+import metrics
+import compaction
+import segments
+from utils import bestinterval
+
 
 local_test = True
 db_test = False
-dump_csv = True
-
-def save_data(sport,df,db):
+dump_parquet = True  # local dump of the workouts for offline analysis (dumpstore)
+dump_dir = '/Users/Shared/data/triathlet/dump'
+num_workers = 1  # > 1: zip-members are parsed in a process pool
+skip_unselected = True  # sniff the sport from the file head and skip files of not selected sports
+sniff_records = 100  # max. records decoded while looking for the sport message
+use_ledger = True  # skip files/workouts already imported (ingestledger)
+max_errors = 50  # error messages kept in the upload result
+spool_max_size = 16 * 2**20  # uncompressed FIT data kept in memory, larger files are spooled to disk
+copy_chunk = 2**20
+save_mean_max = True  # mean-maximal power/HR curve per workout (sportschema.summaries)
+save_summaries = True  # lap, session and time-in-zone summaries per workout (summary)
+compact_frames = True  # narrow dtypes of the parsed frames (sportschema.compact_dtypes)
+row_zones = False  # zone boundaries (hr_zones, power_zones) on every record row, else only in ZONE_TIME
+chunked_size = 4 * 2**20  # uncompressed FIT files larger than this are parsed and saved chunk by chunk (FitChunks)
+chunk_records = 20000  # records per chunk
+compaction_steps = []  # opt-in compaction of the records written to the sport tables, e.g. compaction.steps
+
+def save_data(sport,df,db,batcher=None):
 
     # For local testing only
     if local_test :
         return
 
-    conn = dbapi.connect(address=db['host'],port=db['port'],user=db['user'],password=db['pwd'], encrypt=True,
-                         sslValidateCertificate=False)
-    cursor = conn.cursor()
-    table = ''
-    schema = db['schema']
-    if sport == 'cycling_outdoor' :
-        table = 'CYCLING_OUTDOOR' if db_test == False else 'CYCLING_OUTDOOR_TEST'
-        data = df[["workout_id","date","timestamp","elapsed_time" ,"position_lat","position_long","gps_accuracy","enhanced_altitude","altitude",
-	        "distance","heart_rate","cadence","enhanced_speed","speed","power","left_right_balance","grade",
-	        "temperature","hr_zones","power_zones"]].values.tolist()
-        sql = "UPSERT \"{}\".\"{}\" VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?) WITH PRIMARY KEY;".format(schema,table)
-    elif sport == 'cycling_indoor' :
-        table ='CYCLING_INDOOR' if db_test == False else 'CYCLING_INDOOR_TEST'
-        data = df[["workout_id","date", "timestamp", "elapsed_time", "heart_rate", "cadence", "power", "left_right_balance",
-                   "temperature", "hr_zones", "power_zones"]].values.tolist()
-        sql = "UPSERT \"{}\".\"{}\" VALUES(?,?,?,?,?,?,?,?,?,?,?) WITH PRIMARY KEY;".format(schema,table)
-    elif sport == 'running' :
-        table = 'RUNNING' if db_test == False else 'RUNNING_TEST'
-        data = df[["workout_id","date", "timestamp", "elapsed_time", "position_lat","position_long","gps_accuracy",
-                   "grade","vertical_speed","ascent",
-                   "enhanced_altitude","altitude","distance","heart_rate", "cadence", "fractional_cadence",
-                   "enhanced_speed", "speed", "vertical_oscillation","stance_time","stance_time_percent","temperature","hr_zones"]].values.tolist()
-        sql = "UPSERT \"{}\".\"{}\" VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?) WITH PRIMARY KEY;".format(schema,table)
-    elif sport == 'swimming_pool' :
-        table = 'SWIMMING_POOL' if db_test == False else 'SWIMMING_POOL_TEST'
-        data = df[["workout_id","date", "timestamp", "elapsed_time","distance","total_cycles","heart_rate", "cadence",
-                   "enhanced_speed", "speed","hr_zones"]].values.tolist()
-        sql = "UPSERT \"{}\".\"{}\" VALUES(?,?,?,?,?,?,?,?,?,?,?) WITH PRIMARY KEY;".format(schema,table)
-    elif sport == 'swimming_open_water' :
-        table = 'SWIMMING_OPEN_WATER' if db_test == False else 'SWIMMING_OPEN_WATER_TEST'
-        data = df[["workout_id","date","timestamp","elapsed_time","distance","position_lat","position_long","heart_rate",
-                   "cadence","enhanced_speed", "speed","hr_zones"]].values.tolist()
-        sql = "UPSERT \"{}\".\"{}\" VALUES(?,?,?,?,?,?,?,?,?,?,?,?) WITH PRIMARY KEY;".format(schema,table)
-    elif sport == 'unidentified' :
-        table = 'UNIDENTIFIED_SPORT' if db_test == False else 'UNIDENTIFIED_SPORT_TEST'
-        data = df[["workout_id","date", "timestamp", "elapsed_time", "position_lat","position_long","gps_accuracy",
-                   "enhanced_altitude","altitude","distance","heart_rate", "cadence", "enhanced_speed", "speed",
-                   "power","left_right_balance","grade","temperature","hr_zones","power_zones","vertical_speed",
-                   "ascent","fractional_cadence","vertical_oscillation","stance_time","stance_time_percent","total_cycles"]]\
-            .values.tolist()
-        sql = "UPSERT \"{}\".\"{}\" VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?) WITH PRIMARY KEY;".format(schema,table)
+    columns = sportschema.table_columns(sport)
+    write_table(sportschema.sports[sport]['table'], df, columns, db, batcher)
 
-    else :
-        cursor.close()
-        conn.close()
-        raise ValueError("Unsupported sport")
-    logging.info('Saving data to: {} ({})'.format(table,sql))
-    cursor.executemany(sql, data)
-    cursor.close()
-    conn.close()
-
-def check_column(df,col,fillchar) :
-    try:
-        df[col] = df[col].fillna(fillchar)
-    except KeyError as kerr:
-        logging.debug('Warning: data has not value for {}'.format(kerr))
-        df[col] = 0
+def save_summary(summary,df,db,batcher=None):
 
-def check_columnNumeric(df,col,fillnum) :
-    try:
-        df[col] = pd.to_numeric(df[col],errors='coerce').fillna(fillnum)
-    except KeyError as kerr:
-        logging.debug('Warning: data has not value for {}'.format(kerr))
-        df[col] = 0
+    # For local testing only
+    if local_test :
+        return
 
+    columns = sportschema.summaries[summary]['columns']
+    write_table(sportschema.summaries[summary]['table'], df, columns, db, batcher)
 
-def fit2df(bfile) :
+def test_table(table) :
+    # name of the table written to (db_test: the test copy)
+    return table if db_test == False else table + '_TEST'
 
+def write_table(table,df,columns,db,batcher=None):
+    table = test_table(table)
+    with metrics.timer('save_data') as timer :
+        timer.rows = len(df)
+        if batcher :
+            logging.info('Saving data to: {} ({} rows, batched)'.format(table,len(df)))
+            batcher.add(table, df, columns)
+        else :
+            logging.info('Saving data to: {} ({} rows)'.format(table,len(df)))
+            hanawriter.upsert(db, table, df, columns)
+
+fit_messages = ['record','event','hr_zone','power_zone','sport','lap','session']
+
+# 'record'-fields stored in the sport tables (+ activity_type for identifying the sport)
+# T: timestamp, i: integer, d: float, O: string
+record_fields = {'timestamp':'T', 'position_lat':'i', 'position_long':'i', 'gps_accuracy':'i',
+                 'enhanced_altitude':'d', 'altitude':'d', 'distance':'d', 'heart_rate':'i', 'cadence':'i',
+                 'enhanced_speed':'d', 'speed':'d', 'power':'i', 'left_right_balance':'i', 'grade':'d',
+                 'temperature':'i', 'vertical_speed':'d', 'ascent':'d', 'fractional_cadence':'d',
+                 'vertical_oscillation':'d', 'stance_time':'d', 'stance_time_percent':'d', 'total_cycles':'i',
+                 'activity_type':'O'}
+FIT_EPOCH = 631065600  # 1989-12-31 00:00 UTC
+
+class RecordColumns :
+    # Columnar builder for 'record' messages: the field values are appended straight into typed arrays.
+    # Missing values are NaN (None for strings), of a field repeated in a message (components) the last wins.
+
+    def __init__(self,fields=None) :
+        self.fields = fields or record_fields
+        self.columns = dict()
+        self.layouts = dict()
+        self.num_rows = 0
+
+    def layout(self,fields) :
+        # positions of the wanted fields in a message
+        positions = dict()
+        for i, field in enumerate(fields) :
+            if field.name in self.fields :
+                positions[field.name] = i
+        layout = list()
+        for name, i in positions.items() :
+            kind = self.fields[name]
+            if name not in self.columns :
+                self.columns[name] = list() if kind == 'O' else array('d')
+            layout.append((i, name, kind, self.columns[name]))
+        return layout
+
+    def append(self,msg) :
+        row = self.num_rows
+        fields = msg.fields
+        # messages of the same definition (and timestamp header type) share the field layout
+        key = (msg.def_mesg, msg.header.time_offset is None, len(fields))
+        layout = self.layouts.get(key)
+        if layout is None :
+            layout = self.layouts[key] = self.layout(fields)
+        for i, name, kind, col in layout :
+            value = fields[i].raw_value if kind == 'T' else fields[i].value
+            if kind != 'O' and not isinstance(value,(int,float)) :
+                value = np.nan
+            if len(col) < row :
+                col.extend([None if kind == 'O' else np.nan] * (row - len(col)))
+            col.append(value)
+        self.num_rows += 1
+
+    def __len__(self) :
+        return self.num_rows
+
+    def to_frame(self) :
+        data = dict()
+        for name, col in self.columns.items() :
+            kind = self.fields[name]
+            if len(col) < self.num_rows :
+                col.extend([None if kind == 'O' else np.nan] * (self.num_rows - len(col)))
+            if kind == 'O' :
+                data[name] = col
+                continue
+            values = np.frombuffer(col,dtype=np.float64)
+            if kind == 'T' :
+                values = pd.to_datetime(values + FIT_EPOCH, unit='s')
+            elif kind == 'i' and not np.isnan(values).any() :
+                values = values.astype(np.int64)
+            data[name] = values
+        return pd.DataFrame(data)
+
+class Unkept(list) :
+    # message list of FitFile without keeping the messages: get_messages() yields each decoded message once,
+    # FitFile would hold all of them (most of the memory of a parse)
+    def append(self,message) :
+        pass
+
+def iter_messages(bfile,names=fit_messages,chunk=None) :
+    # Single pass over the file sorting the messages into per-type lists, records into columns
+    # (decoding time per message type: metrics stage 'decode.<type>'). Yields the messages at the end of the file,
+    # with chunk also after every chunk records: the records of the chunk only, the other messages accumulate.
     fitfile = FitFile(bfile)
-    ### read all data and store in df
-
-    # RECORDS
-    records = [rec.get_values() for rec in fitfile.get_messages('record')]
-    df = pd.DataFrame(records)
-
-    # EVENT
-    events = [rec.get_values() for rec in fitfile.get_messages('event')]
-    df_events = pd.DataFrame(events)
-    df_events = df_events.loc[
-        (df_events['event'] == 'timer') & (df_events['event_type'] == 'start'), ['timestamp', 'event_type',
-                                                                                 'timer_trigger']]
-    df = df.merge(df_events, how='left', on='timestamp')
-    df['elapsed_time'] = (df['timestamp'] - df['timestamp'].groupby(df['event_type'].eq('start').cumsum()).transform('first'))
-    df['elapsed_time'] = df['elapsed_time'].dt.total_seconds()
-    df.drop(columns = ['event_type','timer_trigger'],inplace=True)
-
-    # HEARTRATE Zones
-    hr_zone = [rec.get_values() for rec in fitfile.get_messages('hr_zone')]
-    hr_zone_str = '-'.join([str(hr['high_bpm']) for hr in hr_zone]) if len(hr_zone) > 0 else ''
-    df['hr_zones'] = hr_zone_str
-
-    # POWER Zones
-    power_zone = [rec.get_values() for rec in fitfile.get_messages('power_zone')]
-    power_zone_str = '-'.join([str(p['high_value']) for p in power_zone]) if len(power_zone) > 0 else ''
-    df['power_zones'] = power_zone_str
+    if type(getattr(fitfile, '_messages', None)) is list and not fitfile._messages :
+        fitfile._messages = Unkept()  # internals of fitparse 1.2.0 (requirements.txt), other versions keep them
+    messages = {name : list() for name in names}
+    if 'record' in messages :
+        messages['record'] = RecordColumns()
+    seconds = dict.fromkeys(names, 0.)
+    counts = dict.fromkeys(names, 0)
+
+    def decoded() :
+        for name in names :
+            if counts[name] :
+                metrics.record('decode.' + name, 1, seconds[name], counts[name])
+                seconds[name], counts[name] = 0., 0
+
+    start = time.perf_counter()
+    for msg in fitfile.get_messages(names) :
+        if msg.name == 'record' :
+            messages['record'].append(msg)
+        else :
+            messages[msg.name].append(msg.get_values())
+        end = time.perf_counter()
+        seconds[msg.name] += end - start
+        counts[msg.name] += 1
+        if chunk and msg.name == 'record' and len(messages['record']) >= chunk :
+            decoded()
+            yield messages
+            messages['record'] = RecordColumns()
+            end = time.perf_counter()
+        start = end
+    decoded()
+    yield messages
+
+def read_messages(bfile,names=fit_messages) :
+    for messages in iter_messages(bfile,names) :
+        return messages
+
+def sport_candidates(sportmsg) :
+    # sports fit2df can end up with for a 'sport' message (sub_sport and swimming type need the records)
+    if sportmsg.get('sport') == 'cycling' :
+        return {'cycling_indoor','cycling_outdoor'}
+    elif sportmsg.get('sport') == 'running' :
+        return {'running'}
+    elif sportmsg.get('sport') == 'swimming' :
+        return {'swimming_pool','swimming_open_water'}
+    return set()
+
+def sniff_sport(bfile) :
+    # Decodes only the head of the file up to the first 'sport' message. Returns the possible sports,
+    # an empty set if the file cannot be imported or None if the sport can only be derived from the records.
+    start = bfile.tell()
+    fitfile = FitFile(bfile)
+    fitfile.close = lambda : None  # FitFile would close bfile (at the end of a short file, when collected)
+    candidates = None
+    num_records = 0
+    try:
+        for msg in fitfile.get_messages(['file_id','sport','record']) :
+            if msg.name == 'file_id' :
+                if msg.get_value('type') not in [None, 'activity'] :
+                    candidates = set()
+                    break
+            elif msg.name == 'sport' :
+                candidates = sport_candidates(msg.get_values())
+                break
+            else :
+                num_records += 1
+                if num_records >= sniff_records :
+                    break
+    finally:
+        bfile.seek(start)
+    return candidates
+
+def zone_bounds(messages) :
+    # heart rate and power zone boundaries, with row_zones also the zone strings of the record rows
+    hr_zone = messages['hr_zone']
+    power_zone = messages['power_zone']
+    hr_bounds = [hr['high_bpm'] for hr in hr_zone if hr.get('high_bpm') is not None]
+    power_bounds = [p['high_value'] for p in power_zone if p.get('high_value') is not None]
+    strings = dict()
+    if row_zones :
+        strings['hr_zones'] = '-'.join([str(hr['high_bpm']) for hr in hr_zone]) if len(hr_zone) > 0 else ''
+        strings['power_zones'] = '-'.join([str(p['high_value']) for p in power_zone]) if len(power_zone) > 0 else ''
+    return hr_bounds, power_bounds, strings
+
+def identify_sport(sportmsg,df) :
+    # sport from the 'sport' messages, if missing/ambiguous from the records (with elapsed_time)
 
     # SPORT
-    sportmsg = [rec.get_values() for rec in fitfile.get_messages('sport')]
     if len(sportmsg) > 1 :
         if sportmsg[0]['sport'] == 'cycling':
             sportmsg[0]['sub_sport'] = 'generic' if 'speed' in df.columns and df['speed'].max() > 0 else 'indoor'
@@ -171,14 +298,7 @@ def fit2df(bfile) :
             logging.warning('Sport not indentified')
             sport = "unidentified"
 
-    # WORKOUT_ID
-    dtmin = df.timestamp.min()
-    if dtmin == 0 :
-        raise ValueError('Timestamp value: 0 ')
-    df['workout_id'] =  int(dtmin.strftime('%Y%m%d%H%M'))
-    df['date'] = dtmin.strftime('%Y-%m-%d')
-
-    #Additional checks
+    # Additional checks
     if sport == 'unidentified':
         # some checks:
         if 'distance' in df.columns :
@@ -193,194 +313,485 @@ def fit2df(bfile) :
                 sport = 'running'
                 logging.info('Unidentified - identified: {}'.format(sport))
 
-    ############ CYCLING OUTDOOR
-    if sport == 'cycling_outdoor' :
-
-        df = df.dropna(thresh=5)  # drops rows with too few values
-        check_columnNumeric(df, 'heart_rate',0)
-        check_columnNumeric(df, 'cadence', 0)
-        check_columnNumeric(df, 'power', 0)
-        check_columnNumeric(df, 'temperature', -273)
-        check_columnNumeric(df, 'left_right_balance', 0)
-        check_columnNumeric(df, 'position_lat', 0)
-        check_columnNumeric(df, 'position_long', 0)
-        check_columnNumeric(df, 'gps_accuracy', 0)
-        check_columnNumeric(df, 'grade', 0)
-        check_columnNumeric(df, 'enhanced_altitude', 0)
-        check_columnNumeric(df, 'altitude', 0)
-        check_columnNumeric(df, 'enhanced_speed', 0)
-        check_columnNumeric(df, 'speed', 0)
-        check_columnNumeric(df, 'elapsed_time', 0)
-        check_columnNumeric(df, 'distance', 0)
-        df = df.groupby('timestamp').max().reset_index()
-
-    ############ CYCLING INDOOR
-    elif sport == 'cycling_indoor' :
-        #df = df.dropna(thresh=10)  # drops rows with too few values
-
-        check_columnNumeric(df, 'heart_rate',0)
-        check_columnNumeric(df, 'cadence', 0)
-        check_columnNumeric(df, 'power', 0)
-        check_columnNumeric(df, 'cadence', 0)
-        check_columnNumeric(df, 'temperature', -273)
-        check_columnNumeric(df, 'left_right_balance', 0)
-        check_columnNumeric(df, 'elapsed_time', 0)
-        check_column(df, 'hr_zones', '')
-        check_column(df, 'power_zones', '')
-        df = df.groupby('timestamp').max().reset_index()
-
-
-    ############ RUNNING
-    elif sport == 'running' :
-
-        check_columnNumeric(df, 'heart_rate',0)
-        check_columnNumeric(df, 'cadence', 0)
-        check_columnNumeric(df, 'temperature', -273)
-        check_columnNumeric(df, 'stance_time', 0)
-        check_columnNumeric(df, 'stance_time_percent', 0)
-        check_columnNumeric(df, 'vertical_oscillation', 0)
-        check_columnNumeric(df, 'fractional_cadence', 0)
-        check_columnNumeric(df, 'speed', 0)
-        check_columnNumeric(df, 'enhanced_speed', 0)
-        check_columnNumeric(df, 'vertical_speed', 0)
-        check_columnNumeric(df, 'ascent', 0)
-        check_columnNumeric(df, 'distance', 0)
-        check_columnNumeric(df, 'enhanced_altitude', 0)
-        check_columnNumeric(df, 'altitude', 0)
-        check_columnNumeric(df, 'grade', 0)
-        check_columnNumeric(df, 'position_lat', 0)
-        check_columnNumeric(df, 'position_long', 0)
-        check_columnNumeric(df, 'gps_accuracy', 0)
-        check_columnNumeric(df, 'elapsed_time', 0)
-        df = df.groupby('timestamp').max().reset_index()
-
-    ############ Swimming POOL
-    elif sport == 'swimming_pool' :
-        check_columnNumeric(df, 'heart_rate', 0)
-        check_columnNumeric(df, 'cadence', 0)
-        check_columnNumeric(df, 'total_cycles', 0)
-        check_columnNumeric(df, 'cadence', 0)
-        check_columnNumeric(df, 'speed', 0)
-        check_columnNumeric(df, 'enhanced_speed', 0)
-        check_columnNumeric(df, 'distance', 0)
-        check_columnNumeric(df, 'elapsed_time', 0)
-        df = df.groupby('timestamp').max().reset_index()
-
-    ############ Swimming OPEN WATER
-    elif sport == 'swimming_open_water' :
-        check_columnNumeric(df, 'heart_rate', 0)
-        check_columnNumeric(df, 'cadence', 0)
-        check_columnNumeric(df, 'position_lat', 0)
-        check_columnNumeric(df, 'position_long', 0)
-        check_columnNumeric(df, 'speed', 0)
-        check_columnNumeric(df, 'enhanced_speed', 0)
-        check_columnNumeric(df, 'distance', 0)
-        check_columnNumeric(df, 'elapsed_time', 0)
-        df = df.groupby('timestamp').max().reset_index()
-
-    elif sport == 'unidentified' :
-        check_columnNumeric(df, 'heart_rate',0)
-        check_columnNumeric(df, 'cadence', 0)
-        check_columnNumeric(df, 'power', 0)
-        check_columnNumeric(df, 'temperature', -273)
-        check_columnNumeric(df, 'left_right_balance', 0)
-        check_columnNumeric(df, 'stance_time', 0)
-        check_columnNumeric(df, 'stance_time_percent', 0)
-        check_columnNumeric(df, 'vertical_oscillation', 0)
-        check_columnNumeric(df, 'fractional_cadence', 0)
-        check_columnNumeric(df, 'speed', 0)
-        check_columnNumeric(df, 'enhanced_speed', 0)
-        check_columnNumeric(df, 'vertical_speed', 0)
-        check_columnNumeric(df, 'ascent', 0)
-        check_columnNumeric(df, 'distance', 0)
-        check_columnNumeric(df, 'enhanced_altitude', 0)
-        check_columnNumeric(df, 'altitude', 0)
-        check_columnNumeric(df, 'grade', 0)
-        check_columnNumeric(df, 'position_lat', 0)
-        check_columnNumeric(df, 'position_long', 0)
-        check_columnNumeric(df, 'gps_accuracy', 0)
-        check_columnNumeric(df, 'elapsed_time', 0)
-        check_columnNumeric(df, 'total_cycles', 0)
-        df = df.groupby('timestamp').max().reset_index()
-
-    else :
-        raise ValueError('Unknown sport not implemented'.format(sport))
-    logging.info('*** {}  with #Records: {}'.format(sport,len(records)))
-
-    return sport, df
-
-def parse_save_fitfile(bfile,sports,db) :
-    try:
-        sport, df = fit2df(bfile)
-        if sport in sports:
-            save_data(sport, df, db)
-        # Test output
-        if dump_csv :
-            fileout = path.join("/Users/Shared/data/triathlet/dump",sport + '.csv')
-            if path.isfile(fileout) :
-                df.to_csv(fileout,mode='a',index=False,header=False)
-            else :
-                df.to_csv(fileout, index=False, header=True)
-
-    except ValueError as ve:
-        logging.warning('Unsported sport or corrupt data: {}'.format(ve))
-    except FitParseError as fp:
-        logging.warning('Parse Error: {}'.format(fp))
-    #except Exception as e:
-    #    logging.warning('General Exception: {}'.format(e))
-    #    raise Exception(e)
-
-####### INPUT
-def fitfile(inputfile,sports,db) :
+    return sport
 
-    fileext = path.splitext(inputfile.filename)[1]
-    ### Single File: GZ
-    if fileext == '.gz':
-        logging.info('Input GZ-File: {}'.format(inputfile.filename))
-        gzf = gzip.open(inputfile).read()
-        bfile = io.BytesIO(gzf)
-        parse_save_fitfile(bfile, sports, db)
-    ### Single File: FIT
-    elif fileext == '.fit':
-        logging.info('Input Fit-File: {}'.format(inputfile.filename))
-        parse_save_fitfile(inputfile, sports, db)
-    ### Multiple Files: ZIP
-    elif fileext == '.zip':
-        zip = zipfile.ZipFile(inputfile)
-        fit_files = zip.namelist()
-        fit_files = [f for f in fit_files if path.splitext(f)[1] in ['.fit', '.gz']]
-        logging.info('Input File: {} with {} \'fit\'-files'.format(inputfile, len(fit_files)))
+def workout_fields(df) :
+    # workout_id and date from the first record
+    dtmin = df.timestamp.min()
+    if dtmin == 0 :
+        raise ValueError('Timestamp value: 0 ')
+    return {'workout_id' : int(dtmin.strftime('%Y%m%d%H%M')), 'date' : dtmin.strftime('%Y-%m-%d')}
 
-        for i, fit_file in enumerate(fit_files):
+def fit2df(bfile) :
 
+    messages = read_messages(bfile)
+    ### read all data and store in df
 
-            logging.info('Parse file: {}'.format(fit_file))
-            if path.splitext(fit_file)[1] in ['.gz']:
-                gzfitfile = io.BytesIO(zip.read(fit_file))
-                gzf = gzip.open(gzfitfile).read()
-                bfile = io.BytesIO(gzf)
-            else:
-                bfile = io.BytesIO(zip.read(fit_file))
-            parse_save_fitfile(bfile,sports,db)
+    # RECORDS
+    records = messages['record']
+    df = records.to_frame()
+    if len(df) == 0 or 'timestamp' not in df.columns :
+        raise ValueError('No records')
 
+    # ELAPSED TIME per timer segment
+    segment_timer = segments.Timer(messages['event'])
+    df['elapsed_time'] = segment_timer.place(df['timestamp'].to_numpy())['elapsed_time']
 
+    # HEARTRATE/POWER Zones
+    hr_bounds, power_bounds, zone_strings = zone_bounds(messages)
+    for col, value in zone_strings.items() :
+        df[col] = value
 
+    # SPORT
+    sport = identify_sport(messages['sport'], df)
 
+    # WORKOUT_ID
+    for col, value in workout_fields(df).items() :
+        df[col] = value
 
-if __name__ == '__main__' :
+    with metrics.timer('normalize') as timer :
+        df = sportschema.normalize(df,sport,compact_frames)
+        timer.rows = len(df)
+    logging.info('*** {}  with #Records: {}'.format(sport,len(records)))
 
-    logging.basicConfig(level=logging.INFO)
+    # LAP/SESSION summaries, TIME IN ZONE
+    with metrics.timer('summaries') :
+        summaries = summary.summarize(messages['lap'], messages['session'], sport, df.assign(**segment_timer.timing(df)))
+        summaries['zones'] = summary.time_in_zone(df, hr_bounds, power_bounds, sport)
+
+    return sport, df, summaries
+
+class FitChunks :
+    # fit2df for very long files with bounded memory: iterating decodes, normalizes and yields the records chunk by
+    # chunk (chunk_records each). The sport and the workout_id are set from the first chunk and the messages read up
+    # to its end, the timer (segments.Timer) carries across the chunks. Of the records only the columns of the
+    # summaries are kept (with timer_time and moving_time); summaries() returns them and the summaries of the workout
+    # after the last chunk.
+
+    def __init__(self,bfile,size=None) :
+        self.bfile = bfile
+        self.size = size or chunk_records
+        self.messages = None
+        self.sport = None
+        self.workout = None
+        self.zone_strings = None
+        self.timer = segments.Timer()
+        self.num_records = 0
+        self.kept = list()
+
+    def __iter__(self) :
+        for messages in iter_messages(self.bfile, fit_messages, self.size) :
+            self.messages = messages
+            if len(messages['record']) > 0 :
+                yield self.normalize(messages['record'].to_frame())
+        if self.sport is None :
+            raise ValueError('No records')
+        logging.info('*** {}  with #Records: {} (chunked)'.format(self.sport,self.num_records))
+
+    def normalize(self,df) :
+        if 'timestamp' not in df.columns :
+            raise ValueError('No records')
+        self.timer.update(self.messages['event'])
+        df['elapsed_time'] = self.timer.place(df['timestamp'].to_numpy())['elapsed_time']
+        if self.sport is None :
+            _, _, self.zone_strings = zone_bounds(self.messages)
+            self.sport = identify_sport(self.messages['sport'], df)
+            self.workout = workout_fields(df)
+        for col, value in dict(self.zone_strings, **self.workout).items() :
+            df[col] = value
+        with metrics.timer('normalize') as timer :
+            df = sportschema.normalize(df,self.sport,compact_frames)
+            timer.rows = len(df)
+        kept = df[[col for col in summary.record_columns if col in df.columns]]
+        self.kept.append(kept.assign(**self.timer.timing(df)))
+        self.num_records += len(df)
+        return df
+
+    def summaries(self) :
+        records = pd.concat(self.kept, ignore_index=True)
+        self.kept = list()
+        if not records['timestamp'].is_monotonic_increasing :
+            records = records.sort_values('timestamp', kind='stable', ignore_index=True)
+        hr_bounds, power_bounds, _ = zone_bounds(self.messages)
+        with metrics.timer('summaries') :
+            summaries = summary.summarize(self.messages['lap'], self.messages['session'], self.sport, records)
+            summaries['zones'] = summary.time_in_zone(records, hr_bounds, power_bounds, self.sport)
+        return records, summaries
+
+def mean_max_curve(sport,df) :
+    # best average power and heart rate of the workout over sportschema.mean_max_durations (1 s records)
+    durations = [d for d in sportschema.mean_max_durations if d <= len(df)]
+    curve = pd.DataFrame({'duration':durations})
+    curve['workout_id'] = df['workout_id'].iat[0] if len(df) > 0 else 0
+    curve['sport'] = sport
+    curve['date'] = df['date'].iat[0] if len(df) > 0 else None
+    for col in ['power','heart_rate'] :
+        curve[col] = bestinterval.mean_max(df[col].to_numpy(), durations) if col in df.columns and durations else 0.
+    return curve[sportschema.summaries['mean_max']['columns']]
+
+def unselected(bfile,sports) :
+    # True if the head of the file shows a sport that is not selected
+    if not sports or not skip_unselected :
+        return False
+    with metrics.timer('sniff') :
+        candidates = sniff_sport(bfile)
+    if candidates is not None and not candidates & set(sports) :
+        logging.info('Skipped: sport not selected ({})'.format(', '.join(sorted(candidates)) or 'unsupported'))
+        return True
+    return False
+
+def parse_fitfile(bfile,sports=None) :
+    # returns the status ('parsed', 'unselected' or 'failed'), the sport, the data, the summaries and the error message
+    try:
+        if unselected(bfile,sports) :
+            return 'unselected', None, None, None, None
+        with metrics.timer('fit2df') as timer :
+            sport, df, summaries = fit2df(bfile)
+            timer.rows = len(df)
+        return 'parsed', sport, df, summaries, None
+    except ValueError as ve:
+        message = 'Unsported sport or corrupt data: {}'.format(ve)
+    except FitParseError as fp:
+        message = 'Parse Error: {}'.format(fp)
+    logging.warning(message)
+    return 'failed', None, None, None, message
+
+def compact_data(sport,df) :
+    # records for the sport table and the counts of the compaction (None: compaction off)
+    if not compaction_steps :
+        return df, None
+    with metrics.timer('compaction') as timer :
+        kept, stats = compaction.compact(df, sport, compaction_steps)
+        timer.rows = len(df)
+    return kept, stats
+
+def add_stats(total,stats) :
+    if total is None :
+        return dict(stats)
+    return {key: total[key] + stats[key] for key in total}
+
+def save_workout_summaries(sport,df,summaries,db,batcher=None,stats=None) :
+    # df: full records of the workout (also with compaction), stats: counts of the compaction
+    if stats :
+        logging.info('Compaction {}: {} -> {} records, {} -> {} positions'.format(
+            compaction.name(compaction_steps), stats['records'], stats['kept_records'], stats['positions'],
+            stats['kept_positions']))
+        save_summary('compaction', compaction.report(df, sport, stats, compaction_steps), db, batcher)
+    if save_mean_max :
+        save_summary('mean_max', mean_max_curve(sport, df), db, batcher)
+    if save_summaries and summaries :
+        for name, sdf in summaries.items() :
+            save_summary(name, sdf, db, batcher)
+
+def save_fitfile(sport,df,sports,db,batcher=None,summaries=None) :
+    # returns True if the data is saved to the db (local_test: would be saved)
+    saved = False
+    try:
+        if sport in sports:
+            data, stats = compact_data(sport, df)
+            save_data(sport, data, db, batcher)
+            save_workout_summaries(sport, df, summaries, db, batcher, stats)
+            saved = True
+        # Local dump
+        if dump_parquet :
+            dumpstore.write(dump_dir, sport, df)
 
-    # inputfile = "/Users/Shared/data/triathlet/OneDrive_2_11.3.2021.zip"
-    inputfile = "/Users/Shared/data/triathlet/test/2019-04-22-110342-ELEMNT+97D8-314-12.zip"
-    test_outputdir = "/Users/Shared/data/triathlet/csv"
-    with open('config.yaml') as yamls:
-        params = yaml.safe_load(yamls)
+    except ValueError as ve:
+        logging.warning('Unsported sport or corrupt data: {}'.format(ve))
+    #except Exception as e:
+    #    logging.warning('General Exception: {}'.format(e))
+    #    raise Exception(e)
+    return saved
+
+def saved_status() :
+    # status of a file save_fitfile() accepted: with local_test nothing is written
+    return 'parsed' if local_test else 'new'
+
+def parse_save_fitfile(bfile,sports,db,batcher=None) :
+    status, sport, df, summaries, _ = parse_fitfile(bfile,sports)
+    if status == 'parsed' :
+        save_fitfile(sport, df, sports, db, batcher, summaries)
+
+def spool(source,digest) :
+    # Copies a (decompressing) stream chunk-wise into a seekable file for fitparse, hashing on the way.
+    # Only one copy of the uncompressed data exists, above spool_max_size on disk.
+    bfile = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+    with metrics.timer('decompress') as timer :
+        while True :
+            chunk = source.read(copy_chunk)
+            if not chunk :
+                break
+            digest.update(chunk)
+            bfile.write(chunk)
+            timer.bytes += len(chunk)
+    bfile.seek(0)
+    return bfile
+
+known_hashes = frozenset()  # ledger hashes in the worker processes
+worker_archives = dict()  # zip-archives opened in the worker processes
+
+# settings the parsing uses: set in the worker processes from the parent's (they import parsefit anew)
+worker_settings = ['skip_unselected', 'sniff_records', 'spool_max_size', 'copy_chunk', 'compact_frames', 'row_zones',
+                   'chunked_size']
+
+def worker_context() :
+    # Worker processes are not forked from the (multi-threaded) parent: a fork copies locks held by its other threads
+    # (logging, db drivers) and the child can hang on them. The fork server imports parsefit once and forks the
+    # workers from its single thread.
+    if 'forkserver' not in multiprocessing.get_all_start_methods() :
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['parsefit'])
+    return context
+
+def init_worker(hashes,settings) :
+    global known_hashes
+    known_hashes = hashes
+    globals().update(settings)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C: the parent stops the pool
+
+def parse_member(fit_file,source,sports,known=None,stream=None) :
+    # decompress, check the ledger and parse one file (runs in the worker processes for parallel uploads)
+    # source: file-like or bytes, gzip-compressed for '.gz'
+    # Files larger than chunked_size are handed to stream(fit_file, bfile, digest) which parses and saves them chunk
+    # by chunk; without stream (worker) the status is 'large' and the parent ingests the file itself.
+    logging.info('Parse file: {}'.format(fit_file))
+    if isinstance(source,bytes) :
+        source = io.BytesIO(source)
+    digest = ingestledger.new_hash()
+    try:
+        if path.splitext(fit_file)[1] in ['.gz']:
+            source = gzip.GzipFile(fileobj=source, mode='rb')
+        bfile = spool(source, digest)
+    except (OSError, EOFError, zlib.error) as e:
+        message = 'Decompression failed: {}'.format(e)
+        logging.warning(message)
+        return 'failed', None, None, None, message, None
+    with bfile :
+        if digest.hexdigest() in (known if known is not None else known_hashes) :
+            logging.info('Skipped: already imported ({})'.format(fit_file))
+            return 'imported', None, None, None, None, digest.hexdigest()
+        size = bfile.seek(0, 2)
+        bfile.seek(0)
+        if size > chunked_size :
+            if stream is None :
+                return 'large', None, None, None, None, digest.hexdigest()
+            return stream(fit_file, bfile, digest.hexdigest())
+        return parse_fitfile(bfile,sports) + (digest.hexdigest(),)
+
+def in_worker(func,*args) :
+    # runs func in a worker process, returns its result and the stage timings for the parent
+    with metrics.capture() as breakdown :
+        result = func(*args)
+    return result, breakdown
+
+def parse_path(fit_file,sports) :
+    # worker: a .fit/.gz file on disk
+    with open(fit_file,'rb') as source :
+        return parse_member(fit_file, source, sports)
+
+def parse_archive_member(archive,fit_file,sports) :
+    # worker: streams the member from the archive on disk (opened once per worker process)
+    if archive not in worker_archives :
+        worker_archives[archive] = zipfile.ZipFile(archive)
+    with worker_archives[archive].open(fit_file) as source :
+        return parse_member(fit_file, source, sports)
+
+class Upload :
+    # Selected sports, db, table batches, ledger and the number of files per status of one upload
+    # (local_test: 'parsed' instead of 'new', nothing is saved).
+    # progress(fit_file, result) is called after each file.
+
+    def __init__(self,sports,db,force=False,ledger=None,progress=None) :
+        self.sports = sports
+        self.db = db
+        self.force = force
+        self.ledger = ledger
+        self.progress = progress
+        self.batcher = None
+        self.timings = dict()  # metrics breakdown of the upload
+        self.result = {'total':0, 'files':0, 'new':0, 'parsed':0, 'imported':0, 'unselected':0, 'failed':0,
+                       'errors':list()}
+
+    def known(self) :
+        return self.ledger.known_hashes() if self.ledger and not self.force else frozenset()
+
+    def known_workout(self,workout_id) :
+        return self.ledger and not self.force and workout_id is not None and self.ledger.has_workout(workout_id)
+
+    def ingest(self,fit_file,source) :
+        with metrics.capture(self.timings) :
+            self.save(fit_file, *parse_member(fit_file, source, self.sports, self.known(), self.stream))
+
+    def ingest_from(self,fit_file,opener) :
+        with opener() as source :
+            self.ingest(fit_file, source)
+
+    def stream(self,fit_file,bfile,digest) :
+        # Large file: parsed and saved chunk by chunk (FitChunks), the summaries and the ledger entry after the last
+        # chunk. Returns the final status of the file for save(). A file failing after some chunks leaves them in the
+        # tables (without ledger entry: the next upload writes the workout again).
+        chunks = FitChunks(bfile)
+        workout_id = None
+        dump = None
+        stats = None
+        try :
+            if unselected(bfile, self.sports) :
+                return 'unselected', None, None, None, None, digest
+            with metrics.timer('chunked') as timer :
+                for df in chunks :
+                    if workout_id is None :
+                        workout_id = df['workout_id'].iat[0]
+                        if self.known_workout(workout_id) :
+                            logging.info('Skipped: workout {} already imported ({})'.format(workout_id, fit_file))
+                            return 'imported', None, None, None, None, digest
+                        selected = chunks.sport in self.sports
+                        if not selected and not dump_parquet :
+                            return 'unselected', None, None, None, None, digest
+                        if dump_parquet :
+                            dump = dumpstore.Writer(dump_dir, chunks.sport)
+                    if selected :
+                        data, chunk_stats = compact_data(chunks.sport, df)
+                        save_data(chunks.sport, data, self.db, self.batcher)
+                        if chunk_stats :
+                            stats = add_stats(stats, chunk_stats)
+                    if dump :
+                        dump.write(df)
+                    timer.rows += len(df)
+                if dump :
+                    dump.close()
+                if not selected :
+                    return 'unselected', None, None, None, None, digest
+                records, summaries = chunks.summaries()
+                save_workout_summaries(chunks.sport, records, summaries, self.db, self.batcher, stats)
+        except (ValueError, FitParseError) as e :
+            message = 'Unsported sport or corrupt data: {}'.format(e)
+            logging.warning(message)
+            return 'failed', None, None, None, message, digest
+        finally :
+            if dump :
+                dump.abort()  # partial dump file (nothing to do after close())
+        if self.ledger :
+            self.ledger.add(digest, workout_id, chunks.sport, fit_file, chunks.num_records)
+        return saved_status(), None, None, None, None, digest
+
+    def save(self,fit_file,status,sport,df,summaries,message,digest) :
+        with metrics.capture(self.timings) :
+            self.save_file(fit_file, status, sport, df, summaries, message, digest)
+
+    def save_file(self,fit_file,status,sport,df,summaries,message,digest) :
+        if status == 'parsed' :
+            workout_id = df['workout_id'].iloc[0] if len(df) > 0 else None
+            if self.known_workout(workout_id) :
+                logging.info('Skipped: workout {} already imported ({})'.format(workout_id, fit_file))
+                status = 'imported'
+            elif save_fitfile(sport, df, self.sports, self.db, self.batcher, summaries) :
+                status = saved_status()
+                if self.ledger and workout_id is not None :
+                    self.ledger.add(digest, workout_id, sport, fit_file, len(df))
+            else :
+                status = 'unselected'
+        self.result['files'] += 1
+        self.result[status] += 1
+        metrics.record('file.' + status)
+        if message and len(self.result['errors']) < max_errors :
+            self.result['errors'].append({'file':fit_file, 'error':message})
+        if self.progress :
+            self.progress(fit_file, self.result)
+
+def parallel_parse(items,upload,workers) :
+    # Parsing in a process pool, saving in 1 thread overlapping with the parsing. In-flight files and
+    # parsed frames waiting for the db are bounded to keep the memory flat for large archives.
+    # items (consumed lazily): fit_file, worker function, its arguments and opener() of the file in the parent
+    # (files above chunked_size are ingested by the parent, chunk by chunk)
+    max_pending = 2 * workers
+    settings = {name : globals()[name] for name in worker_settings}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context(), initializer=init_worker,
+                             initargs=(upload.known(), settings)) as pool, \
+            ThreadPoolExecutor(max_workers=1) as writer:
+        parsing = dict()
+        saving = set()
+
+        def collect(done) :
+            for future in done :
+                result, breakdown = future.result()
+                metrics.merge(breakdown)
+                fit_file, opener = parsing.pop(future)
+                if result[0] == 'large' :
+                    # saved chunk by chunk while parsing, in the writer thread
+                    saving.add(writer.submit(upload.ingest_from, fit_file, opener))
+                else :
+                    saving.add(writer.submit(upload.save, fit_file, *result))
+            while len(saving) > workers :
+                saved, _ = wait(saving, return_when=FIRST_COMPLETED)
+                for future in saved :
+                    saving.remove(future)
+                    future.result()
+
+        for fit_file, func, args, opener in items :
+            if len(parsing) >= max_pending :
+                done, _ = wait(parsing, return_when=FIRST_COMPLETED)
+                collect(done)
+            parsing[pool.submit(in_worker, func, *args)] = (fit_file, opener)
+        collect(wait(parsing).done)
+        for future in wait(saving).done :
+            future.result()
+
+def parallel_zip(zip,fit_files,upload,workers,archive=None) :
+    # With the archive on disk the workers read the members themselves, otherwise the members are sent.
+    def items() :
+        for fit_file in fit_files :
+            if archive :
+                yield fit_file, parse_archive_member, (archive, fit_file, upload.sports), partial(zip.open, fit_file)
+            else :
+                yield fit_file, parse_member, (fit_file, zip.read(fit_file), upload.sports), partial(zip.open, fit_file)
+    parallel_parse(items(), upload, workers)
 
-    db = {'host': params['HDB_HOST'],
-          'user': params['HDB_USER'],
-          'pwd': params['HDB_PWD'],
-          'port': params['HDB_PORT']}
+def archive_path(inputfile) :
+    # path of an upload stored on disk (e.g. spooled by the job queue)
+    stream = getattr(inputfile, 'stream', inputfile)
+    name = getattr(stream, 'name', None)
+    return name if isinstance(name, str) and path.isfile(name) else None
 
-    sports = ['cycling_indoor','cycling_outdoor','running','swimming_pool', 'Swimming Pool','swimming_open_water']
-    fitfile(inputfile,sports,db)
\ No newline at end of file
+####### INPUT
+def fitfile(inputfile,sports,db,workers=None,force=False,progress=None) :
+
+    workers = workers or num_workers
+    ledger = ingestledger.Ledger(db, test_table(ingestledger.ledger_table)) if use_ledger and not local_test else None
+    upload = Upload(sports, db, force, ledger, progress)
+    with metrics.capture(upload.timings), metrics.timer('fitfile') :
+        fileext = path.splitext(inputfile.filename)[1]
+        ### Single File: GZ
+        if fileext == '.gz':
+            logging.info('Input GZ-File: {}'.format(inputfile.filename))
+            upload.result['total'] = 1
+            upload.ingest(inputfile.filename, inputfile)
+        ### Single File: FIT
+        elif fileext == '.fit':
+            logging.info('Input Fit-File: {}'.format(inputfile.filename))
+            upload.result['total'] = 1
+            upload.ingest(inputfile.filename, inputfile)
+        ### Multiple Files: ZIP
+        elif fileext == '.zip':
+            zip = zipfile.ZipFile(inputfile)
+            fit_files = zip.namelist()
+            fit_files = [f for f in fit_files if path.splitext(f)[1] in ['.fit', '.gz']]
+            logging.info('Input File: {} with {} \'fit\'-files'.format(inputfile, len(fit_files)))
+            upload.result['total'] = len(fit_files)
+
+            # rows of all files are written in batches per table
+            with hanawriter.Batcher(db) as upload.batcher :
+                if workers > 1 :
+                    logging.info('Parsing with {} worker processes'.format(workers))
+                    parallel_zip(zip, fit_files, upload, workers, archive_path(inputfile))
+                else :
+                    for i, fit_file in enumerate(fit_files):
+                        upload.ingest_from(fit_file, partial(zip.open, fit_file))
+
+        # ledger entries only after the data is written
+        if ledger :
+            ledger.flush()
+    logging.info('Upload finished: {}'.format(upload.result))
+    upload.result['timings'] = metrics.summary(upload.timings)
+    logging.info('Upload timings: {}'.format(upload.result['timings']))
+    return upload.result
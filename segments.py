@@ -0,0 +1,113 @@
+###
+# Timer segments of a workout from the FIT timer events
+# Every 'start' event begins a segment, the stop events (stop_types) pause the timer. The events are sorted once,
+# the records are placed between them with searchsorted (no join on the timestamps, any record order):
+#   segment:      number of start events at or before the record (0: records before the first start event)
+#   elapsed_time: seconds since the start of the segment (the start event, segment 0: the first record)
+#   timer_time:   seconds the timer ran since the first record (running before the first event)
+#   moving_time:  seconds moving (moving_speed) with the timer running since the first record, of the normalized
+#                 records (sorted by timestamp; a sample counts the time since the previous one, see max_gap)
+# Start events between two records start the segment at their own timestamp, events before the first record at
+# the first record.
+# ids() numbers the segments of normalized records by their elapsed_time (e.g. read back from the tables).
+###
+
+import numpy as np
+
+import summary
+
+stop_types = ['stop', 'stop_all', 'stop_disable', 'stop_disable_all']
+moving_speed = 0.5  # m/s
+max_gap = summary.max_gap  # s between samples, longer gaps count 1 s
+
+
+def seconds(delta):
+    return delta / np.timedelta64(1, 's')
+
+
+class Timer:
+    # Timer of one workout. update() with the timer events read so far (chunk by chunk they accumulate), place() the
+    # parsed records, timing() the normalized ones. The first record and the last normalized one carry over chunks.
+
+    def __init__(self, events=()):
+        self.origin = None  # timestamp of the first record
+        self.last = None  # timestamp, distance, timer_time and moving_time of the last record of timing()
+        self.update(events)
+
+    def update(self, events):
+        timer = [(e['timestamp'], e.get('event_type') == 'start') for e in events
+                 if e.get('event') == 'timer' and e.get('timestamp') is not None
+                 and (e.get('event_type') == 'start' or e.get('event_type') in stop_types)]
+        times = np.array([time for time, _ in timer], dtype='datetime64[ns]')
+        order = np.argsort(times, kind='stable')
+        self.times = times[order]
+        self.running = np.array([start for _, start in timer], dtype=bool)[order]  # after the event
+        self.starts = self.times[self.running]
+
+    def place(self, ts):
+        # segment, elapsed_time, timer_time and running of the records with the timestamps ts (datetime64, computed
+        # in their unit: no conversion of the records)
+        if self.origin is None:
+            valid = ts[~np.isnat(ts)]
+            self.origin = valid.min() if len(valid) > 0 else np.datetime64('NaT', 'ns')
+        unit = ts.dtype if ts.dtype.kind == 'M' else np.dtype('datetime64[ns]')
+        origin = np.array([self.origin], dtype=unit)
+        # events before the first record count at the first record
+        times = np.maximum(self.times.astype(unit), origin)
+        starts = np.maximum(self.starts.astype(unit), origin)
+        segment = np.searchsorted(starts, ts, side='right')
+        firsts = np.concatenate([origin, starts])
+        elapsed = seconds(ts - firsts[segment])
+
+        # timer seconds at the events, the records from the event before them on
+        edges = np.concatenate([origin, times])
+        state = np.concatenate([[True], self.running])
+        at_event = np.concatenate([[0.], np.cumsum(np.clip(seconds(np.diff(edges)), 0, None) * state[:-1])])
+        event = np.searchsorted(times, ts, side='right')
+        running = state[event]
+        timer = at_event[event] + np.clip(seconds(ts - edges[event]), 0, None) * running
+        return {'segment': segment, 'elapsed_time': elapsed, 'timer_time': timer, 'running': running}
+
+    def timing(self, df):
+        # timer_time and moving_time of normalized records: a moving sample counts its seconds the timer ran
+        ts = df['timestamp'].to_numpy()
+        placed = self.place(ts)
+        timer = placed['timer_time']
+        previous = self.last or (ts[0] if len(ts) > 0 else None, None, timer[0] if len(ts) > 0 else 0., 0.)
+        sample = np.zeros(len(ts))
+        if len(ts) > 0:
+            sample = seconds(np.diff(ts, prepend=previous[0]))
+            sample[sample > max_gap] = 1.
+        running = np.minimum(sample, np.diff(timer, prepend=previous[2]))
+        moving_time = previous[3] + np.cumsum(running * moving(df, sample, previous[1]))
+        if len(ts) > 0:
+            distance = df['distance'].iat[-1] if 'distance' in df.columns else None
+            self.last = (ts[-1], distance, timer[-1], moving_time[-1])
+        return {'timer_time': timer, 'moving_time': moving_time}
+
+
+def moving(df, sample, distance=None):
+    # records moving: speed (else the distance since the previous record) at least moving_speed, without both
+    # cadence or power; distance: of the record before df
+    for col in ['enhanced_speed', 'speed']:
+        if col in df.columns and df[col].to_numpy().any():
+            return df[col].to_numpy(dtype=np.float64) >= moving_speed
+    if 'distance' in df.columns and df['distance'].to_numpy().any():
+        values = df['distance'].to_numpy(dtype=np.float64)
+        step = np.diff(values, prepend=values[0] if distance is None else distance)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return step >= moving_speed * np.where(sample > 0, sample, 1.)
+    active = np.zeros(len(df), dtype=bool)
+    for col in ['cadence', 'power']:
+        if col in df.columns:
+            active |= df[col].to_numpy() > 0
+    return active if any(col in df.columns for col in ['cadence', 'power']) else np.ones(len(df), dtype=bool)
+
+
+def ids(df):
+    # segment number of normalized records: the segment start (timestamp - elapsed_time) changes
+    ts = df['timestamp'].to_numpy()
+    start = seconds(ts - ts[:1]) - df['elapsed_time'].to_numpy(dtype=np.float64) if len(ts) > 0 else np.zeros(0)
+    segment = np.zeros(len(df), dtype=np.int64)
+    segment[1:] = np.cumsum(np.abs(np.diff(start)) > 0.5)
+    return segment
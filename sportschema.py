@@ -0,0 +1,175 @@
+###
+# Target tables of the sports and the normalization of the parsed data
+# Adding a sport: one entry in 'sports' (+ new columns in 'columns')
+# Summary tables per workout ('summaries'), written with the data of the workout. Created (and brought to the
+# columns of 'summaries') by migrate.py, which generates their DDL from 'summaries' and sql_types:
+#   python migrate.py [--sqlite db] [--test] [--print]
+###
+
+import numpy as np
+import pandas as pd
+
+# column: (dtype, fill value for missing data). Fill value None: set by fit2df, taken as is
+columns = {
+    'workout_id': ('int64', None),
+    'date': ('object', None),
+    'timestamp': ('datetime64', None),
+    'elapsed_time': ('float64', 0),
+    'position_lat': ('int64', 0),
+    'position_long': ('int64', 0),
+    'gps_accuracy': ('int64', 0),
+    'enhanced_altitude': ('float64', 0),
+    'altitude': ('float64', 0),
+    'distance': ('float64', 0),
+    'heart_rate': ('int64', 0),
+    'cadence': ('int64', 0),
+    'fractional_cadence': ('float64', 0),
+    'enhanced_speed': ('float64', 0),
+    'speed': ('float64', 0),
+    'vertical_speed': ('float64', 0),
+    'ascent': ('float64', 0),
+    'power': ('int64', 0),
+    'left_right_balance': ('int64', 0),
+    'grade': ('float64', 0),
+    'temperature': ('int64', -273),
+    'vertical_oscillation': ('float64', 0),
+    'stance_time': ('float64', 0),
+    'stance_time_percent': ('float64', 0),
+    'total_cycles': ('int64', 0),
+    'hr_zones': ('object', ''),
+    'power_zones': ('object', '')}
+
+# compact mode: narrow dtypes of the parsed frames (values unchanged: FIT resolution fits into float32)
+compact_dtypes = {
+    'date': 'category',
+    'elapsed_time': 'int32',
+    'position_lat': 'int32',
+    'position_long': 'int32',
+    'gps_accuracy': 'int16',
+    'enhanced_altitude': 'float32',
+    'altitude': 'float32',
+    'heart_rate': 'int16',
+    'cadence': 'int16',
+    'fractional_cadence': 'float32',
+    'enhanced_speed': 'float32',
+    'speed': 'float32',
+    'vertical_speed': 'float32',
+    'ascent': 'float32',
+    'power': 'int16',
+    'left_right_balance': 'int16',
+    'grade': 'float32',
+    'temperature': 'int16',
+    'vertical_oscillation': 'float32',
+    'stance_time': 'float32',
+    'stance_time_percent': 'float32',
+    'total_cycles': 'int32',
+    'hr_zones': 'category',
+    'power_zones': 'category'}
+
+# sport: target table and its columns in table order
+sports = {
+    'cycling_outdoor': {'table': 'CYCLING_OUTDOOR',
+                        'columns': ['workout_id', 'date', 'timestamp', 'elapsed_time', 'position_lat', 'position_long',
+                                    'gps_accuracy', 'enhanced_altitude', 'altitude', 'distance', 'heart_rate',
+                                    'cadence', 'enhanced_speed', 'speed', 'power', 'left_right_balance', 'grade',
+                                    'temperature', 'hr_zones', 'power_zones']},
+    'cycling_indoor': {'table': 'CYCLING_INDOOR',
+                       'columns': ['workout_id', 'date', 'timestamp', 'elapsed_time', 'heart_rate', 'cadence',
+                                   'power', 'left_right_balance', 'temperature', 'hr_zones', 'power_zones']},
+    'running': {'table': 'RUNNING',
+                'columns': ['workout_id', 'date', 'timestamp', 'elapsed_time', 'position_lat', 'position_long',
+                            'gps_accuracy', 'grade', 'vertical_speed', 'ascent', 'enhanced_altitude', 'altitude',
+                            'distance', 'heart_rate', 'cadence', 'fractional_cadence', 'enhanced_speed', 'speed',
+                            'vertical_oscillation', 'stance_time', 'stance_time_percent', 'temperature', 'hr_zones']},
+    'swimming_pool': {'table': 'SWIMMING_POOL',
+                      'columns': ['workout_id', 'date', 'timestamp', 'elapsed_time', 'distance', 'total_cycles',
+                                  'heart_rate', 'cadence', 'enhanced_speed', 'speed', 'hr_zones']},
+    'swimming_open_water': {'table': 'SWIMMING_OPEN_WATER',
+                            'columns': ['workout_id', 'date', 'timestamp', 'elapsed_time', 'distance', 'position_lat',
+                                        'position_long', 'heart_rate', 'cadence', 'enhanced_speed', 'speed',
+                                        'hr_zones']},
+    'unidentified': {'table': 'UNIDENTIFIED_SPORT',
+                     'columns': ['workout_id', 'date', 'timestamp', 'elapsed_time', 'position_lat', 'position_long',
+                                 'gps_accuracy', 'enhanced_altitude', 'altitude', 'distance', 'heart_rate', 'cadence',
+                                 'enhanced_speed', 'speed', 'power', 'left_right_balance', 'grade', 'temperature',
+                                 'hr_zones', 'power_zones', 'vertical_speed', 'ascent', 'fractional_cadence',
+                                 'vertical_oscillation', 'stance_time', 'stance_time_percent', 'total_cycles']}}
+
+# zones (seconds) per workout in ZONE_TIME, zone 0: below the first boundary
+num_zones = 8
+
+# summary: target table, its columns in table order and its primary key
+summaries = {
+    'mean_max': {'table': 'MEAN_MAX',
+                 'columns': ['workout_id', 'sport', 'duration', 'date', 'power', 'heart_rate'],
+                 'key': ['workout_id', 'sport', 'duration']},
+    'lap': {'table': 'LAP_SUMMARY',
+            'columns': ['workout_id', 'sport', 'lap', 'date', 'start_time', 'elapsed_time', 'timer_time',
+                        'moving_time', 'distance', 'avg_power', 'max_power', 'avg_heart_rate', 'max_heart_rate',
+                        'avg_cadence', 'max_cadence', 'elevation_gain', 'source'],
+            'key': ['workout_id', 'sport', 'lap']},
+    'session': {'table': 'SESSION_SUMMARY',
+                'columns': ['workout_id', 'sport', 'date', 'start_time', 'num_laps', 'elapsed_time', 'timer_time',
+                            'moving_time', 'distance', 'avg_power', 'max_power', 'avg_heart_rate', 'max_heart_rate',
+                            'avg_cadence', 'max_cadence', 'elevation_gain', 'source'],
+                'key': ['workout_id', 'sport']},
+    'zones': {'table': 'ZONE_TIME',
+              'columns': ['workout_id', 'sport', 'date', 'hr_zones'] + ['hr_z{}'.format(i) for i in range(num_zones)]
+                         + ['power_zones'] + ['power_z{}'.format(i) for i in range(num_zones)],
+              'key': ['workout_id', 'sport']},
+    # records written per workout with the opt-in compaction (compaction)
+    'compaction': {'table': 'COMPACTION',
+                   'columns': ['workout_id', 'sport', 'date', 'steps', 'records', 'kept_records', 'positions',
+                               'kept_positions', 'ratio'],
+                   'key': ['workout_id', 'sport']}}
+
+# SQL (HANA) types of the summary columns, DOUBLE if not listed
+sql_types = {'workout_id': 'BIGINT', 'sport': 'NVARCHAR(25)', 'date': 'DAYDATE', 'start_time': 'LONGDATE',
+             'duration': 'INTEGER', 'lap': 'INTEGER', 'num_laps': 'INTEGER', 'hr_zones': 'NVARCHAR(50)',
+             'power_zones': 'NVARCHAR(50)', 'source': 'NVARCHAR(10)', 'steps': 'NVARCHAR(50)', 'records': 'INTEGER',
+             'kept_records': 'INTEGER', 'positions': 'INTEGER', 'kept_positions': 'INTEGER'}
+
+# durations (s) of the mean-maximal curve
+mean_max_durations = [1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 5400, 7200]
+
+
+def table_columns(sport):
+    if sport not in sports:
+        raise ValueError('Unsupported sport: {}'.format(sport))
+    return sports[sport]['columns']
+
+
+def normalize(df, sport, compact=False):
+    # One pass over the columns of the sport table: numeric conversion, max of duplicate timestamps
+    # (NaN ignored) and fill of missing values. Returns the columns in table order sorted by timestamp,
+    # with compact=True in the compact_dtypes.
+    cols = table_columns(sport)
+    df = df[df['timestamp'].notna()]
+    ts = df['timestamp'].to_numpy()
+    order = np.argsort(ts, kind='stable')
+    ts = ts[order]
+    first = np.ones(len(ts), dtype=bool)
+    first[1:] = ts[1:] != ts[:-1]
+    starts = np.flatnonzero(first)
+    duplicates = len(starts) < len(ts)
+
+    data = dict()
+    for col in cols:
+        dtype, fill = columns[col]
+        if col == 'timestamp':
+            data[col] = ts[starts]
+        elif fill is None or dtype == 'object':
+            values = df[col].to_numpy()[order][starts] if col in df.columns else np.full(len(starts), fill)
+            data[col] = pd.Series(values).fillna(fill).to_numpy() if fill is not None else values
+            if compact and compact_dtypes.get(col) == 'category':
+                data[col] = pd.Categorical(data[col])
+        else:
+            if col in df.columns:
+                values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)[order]
+                if duplicates:
+                    values = np.fmax.reduceat(values, starts)
+                values[np.isnan(values)] = fill
+            else:
+                values = np.full(len(starts), fill, dtype=np.float64)
+            data[col] = values.astype(compact_dtypes.get(col, dtype) if compact else dtype)
+    return pd.DataFrame(data, columns=cols)
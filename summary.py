@@ -0,0 +1,171 @@
+###
+# Lap, session and time-in-zone summaries of a workout
+# Taken from the FIT 'lap' and 'session' messages; fields missing in the messages (or the whole messages) are
+# derived from the records. The records are assigned to the laps by the lap start times, the aggregates are
+# computed per contiguous lap segment (reduceat), without a loop over the laps. Timer and moving time of the laps
+# from the cumulative timer_time and moving_time of the records (segments.Timer), without them the elapsed time.
+# Time in zone: the samples are binned by the zone boundaries (searchsorted) and their durations summed (bincount).
+###
+
+import numpy as np
+import pandas as pd
+
+import sportschema
+
+# FIT field: summary column
+message_fields = {'start_time': 'start_time', 'total_elapsed_time': 'elapsed_time', 'total_timer_time': 'timer_time',
+                  'total_moving_time': 'moving_time', 'total_distance': 'distance', 'avg_power': 'avg_power',
+                  'max_power': 'max_power',
+                  'avg_heart_rate': 'avg_heart_rate', 'max_heart_rate': 'max_heart_rate',
+                  'avg_cadence': 'avg_cadence', 'max_cadence': 'max_cadence', 'total_ascent': 'elevation_gain',
+                  'num_laps': 'num_laps'}
+
+# record column: zeros are missing values (not averaged)
+averaged = {'power': False, 'heart_rate': True, 'cadence': True}
+
+max_gap = 10  # s between samples, longer gaps are pauses (the sample counts 1 s)
+
+# FIT resolution (steps per unit) of the record columns summed/subtracted for the summaries: computed in whole steps,
+# the float32 (altitude) and decimal (distance) noise does not reach the tables (16.4, not 16.399993896484375)
+steps_per_metre = {'altitude': 5, 'distance': 100}
+
+# record columns the summaries (and the mean-max curve) use
+record_columns = ['workout_id', 'date', 'timestamp', 'distance', 'power', 'heart_rate', 'cadence', 'enhanced_altitude',
+                  'altitude']
+
+
+def column(df, name):
+    return df[name].to_numpy(dtype=np.float64) if name in df.columns else np.zeros(len(df))
+
+
+def steps(values, name):
+    # values in whole FIT steps (float64, exact)
+    return np.round(values * steps_per_metre[name])
+
+
+def span(df, name, starts, ends, default):
+    # growth of a cumulative record column over the segments
+    if name not in df.columns:
+        return default
+    values = column(df, name)
+    return values[ends] - values[starts]
+
+
+def aggregate(df, segment):
+    # aggregates of the records per segment (non-decreasing segment number per record)
+    ts = df['timestamp'].to_numpy()
+    first = np.ones(len(df), dtype=bool)
+    first[1:] = segment[1:] != segment[:-1]
+    starts = np.flatnonzero(first)
+    ends = np.append(starts[1:], len(df)) - 1
+    seconds = (ts[ends] - ts[starts]) / np.timedelta64(1, 's')
+    distance = steps(column(df, 'distance'), 'distance')
+    data = {'start_time': ts[starts], 'elapsed_time': seconds,
+            'timer_time': span(df, 'timer_time', starts, ends, seconds),
+            'moving_time': span(df, 'moving_time', starts, ends, seconds),
+            'distance': (np.maximum.reduceat(distance, starts) - np.minimum.reduceat(distance, starts))
+            / steps_per_metre['distance']}
+    for name, skip_zeros in averaged.items():
+        values = column(df, name)
+        counts = np.add.reduceat((values > 0) if skip_zeros else np.ones(len(values)), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            data['avg_' + name] = np.where(counts > 0, np.add.reduceat(values, starts) / counts, 0.)
+        data['max_' + name] = np.maximum.reduceat(values, starts)
+    altitude = column(df, 'enhanced_altitude')
+    if not altitude.any():
+        altitude = column(df, 'altitude')
+    climb = np.zeros(len(df))
+    climb[1:] = np.clip(np.diff(steps(altitude, 'altitude')), 0, None)
+    climb[starts] = 0
+    data['elevation_gain'] = np.add.reduceat(climb, starts) / steps_per_metre['altitude']
+    return pd.DataFrame(data, index=segment[starts])
+
+
+def from_messages(messages):
+    rows = [{col: msg.get(field) for field, col in message_fields.items() if msg.get(field) is not None}
+            for msg in messages]
+    return pd.DataFrame(rows, columns=list(message_fields.values())).drop(columns='num_laps')
+
+
+def finish(df, workout, sport, name):
+    df['workout_id'] = workout['workout_id']
+    df['sport'] = sport
+    df['date'] = workout['date']
+    return df[sportschema.summaries[name]['columns']]
+
+
+def summarize(laps, sessions, sport, df):
+    # laps, sessions: values of the 'lap' and 'session' messages; df: normalized records of the workout
+    # Returns the lap and the session summary frames in table order.
+    if len(df) == 0:
+        return {'lap': pd.DataFrame(columns=sportschema.summaries['lap']['columns']),
+                'session': pd.DataFrame(columns=sportschema.summaries['session']['columns'])}
+    workout = df.iloc[0]
+    ts = df['timestamp'].to_numpy()
+
+    # LAPS
+    laps = sorted([lap for lap in laps if lap.get('start_time') is not None], key=lambda lap: lap['start_time'])
+    lap_starts = np.array([lap['start_time'] for lap in laps], dtype='datetime64[ns]')
+    segment = np.clip(np.searchsorted(lap_starts, ts, side='right') - 1, 0, None) if laps else np.zeros(len(df), int)
+    derived = aggregate(df, segment)
+    if laps:
+        lap_df = from_messages(laps).combine_first(derived)
+        lap_df['source'] = 'fit'
+    else:
+        lap_df = derived
+        lap_df['source'] = 'records'
+    lap_df = lap_df.rename_axis('lap').reset_index()
+
+    # SESSION
+    session_df = aggregate(df, np.zeros(len(df), dtype=int))
+    session_df['num_laps'] = len(lap_df)
+    session_df['source'] = 'records'
+    if sessions:
+        session = from_messages(sessions[:1])
+        session['num_laps'] = sessions[0].get('num_laps') or len(lap_df)
+        session_df = session.combine_first(session_df)
+        session_df['source'] = 'fit'
+
+    for frame in (lap_df, session_df):
+        frame['start_time'] = pd.to_datetime(frame['start_time'])
+    lap_df['lap'] = lap_df['lap'].astype('int64')
+    session_df['num_laps'] = session_df['num_laps'].astype('int64')
+    return {'lap': finish(lap_df, workout, sport, 'lap'), 'session': finish(session_df, workout, sport, 'session')}
+
+
+def sample_seconds(df):
+    # duration of each sample: time to the next sample, pauses and the last sample 1 s
+    ts = df['timestamp'].to_numpy()
+    seconds = np.ones(len(ts))
+    seconds[:-1] = np.diff(ts) / np.timedelta64(1, 's')
+    seconds[seconds > max_gap] = 1.
+    return seconds
+
+
+def zone_seconds(values, bounds, seconds, skip_zeros=False):
+    # seconds per zone; zone i: bounds[i-1] < value <= bounds[i], the last zone is above all bounds
+    # (zones beyond sportschema.num_zones are added to the last column)
+    times = np.zeros(sportschema.num_zones)
+    if len(bounds) == 0:
+        return times
+    weights = seconds * (values > 0) if skip_zeros else seconds
+    zone = np.minimum(np.searchsorted(np.sort(bounds), values, side='left'), sportschema.num_zones - 1)
+    return times + np.bincount(zone, weights=weights, minlength=sportschema.num_zones)
+
+
+def time_in_zone(df, hr_bounds, power_bounds, sport):
+    # one row per workout: the zone boundaries and the seconds per heart rate and power zone
+    columns = sportschema.summaries['zones']['columns']
+    if len(df) == 0:
+        return pd.DataFrame(columns=columns)
+    seconds = sample_seconds(df)
+    row = {'hr_zones': '-'.join(str(b) for b in hr_bounds), 'power_zones': '-'.join(str(b) for b in power_bounds)}
+    for prefix, name, bounds, skip_zeros in [('hr', 'heart_rate', hr_bounds, True),
+                                             ('power', 'power', power_bounds, False)]:
+        times = zone_seconds(column(df, name), np.array(bounds, dtype=np.float64), seconds, skip_zeros)
+        if not column(df, name).any():
+            times[:] = 0.
+        for i, value in enumerate(times):
+            row['{}_z{}'.format(prefix, i)] = value
+    zones = pd.DataFrame([row])
+    return finish(zones, df.iloc[0], sport, 'zones')
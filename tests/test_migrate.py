@@ -0,0 +1,36 @@
+###
+# migrate.py on the sqlite stand-in: tables created, a table of an older version rebuilt with its rows
+###
+
+import sqlite3
+
+import migrate
+import sportschema
+import hanawriter
+
+
+def test_migrate(tmp_path):
+    database = str(tmp_path / 'test.db')
+    db = {'dialect': 'sqlite', 'database': database}
+    # LAP_SUMMARY before MOVING_TIME
+    old = [col for col in sportschema.summaries['lap']['columns'] if col != 'moving_time']
+    conn = sqlite3.connect(database)
+    conn.execute('CREATE TABLE "LAP_SUMMARY" ({})'.format(', '.join('"{}"'.format(col.upper()) for col in old)))
+    conn.execute('INSERT INTO "LAP_SUMMARY" ("WORKOUT_ID", "SPORT", "LAP", "TIMER_TIME", "DISTANCE") '
+                 'VALUES (202103220800, \'running\', 1, 1800.0, 5000.0)')
+    conn.commit()
+    conn.close()
+    try:
+        assert migrate.migrate(db)
+        assert migrate.migrate(db) == []
+    finally:
+        hanawriter.close_pools()
+
+    conn = sqlite3.connect(database)
+    tables = {row[0] for row in conn.execute('SELECT name FROM sqlite_master WHERE type = \'table\'')}
+    columns = [row[1] for row in conn.execute('PRAGMA table_info("LAP_SUMMARY")')]
+    row = conn.execute('SELECT "WORKOUT_ID", "TIMER_TIME", "MOVING_TIME", "DISTANCE" FROM "LAP_SUMMARY"').fetchall()
+    conn.close()
+    assert tables == {summary['table'] for summary in sportschema.summaries.values()} | {'INGEST_LEDGER'}
+    assert columns == [col.upper() for col in sportschema.summaries['lap']['columns']]
+    assert row == [(202103220800, 1800.0, None, 5000.0)]
@@ -0,0 +1,60 @@
+###
+# Upload of a zip with a record-less member: the member fails, the other members are saved
+#
+# python -m pytest tests
+###
+
+import io
+import sqlite3
+import zipfile
+from datetime import datetime, timezone
+
+import pytest
+
+from benchmarks.synthfit import FitWriter, synth_fit, fit_timestamp
+from benchmarks.suite import create_tables
+import parsefit
+import sportschema
+import hanawriter
+
+
+def recordless_fit():
+    # file_id and a timer event, no record messages
+    ts = fit_timestamp(datetime(2021, 3, 22, 8, tzinfo=timezone.utc))
+    w = FitWriter()
+    w.define(0, 'file_id', ['type', 'manufacturer', 'product', 'serial_number', 'time_created'])
+    w.write(0, [4, 255, 1, 12345, ts])
+    w.define(1, 'event', ['timestamp', 'event', 'event_type', 'data', 'event_group'])
+    w.write(1, [ts, 0, 0, 0, 0])
+    return w.getvalue()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('chunked', [False, True])
+def test_recordless_member(tmp_path, monkeypatch, workers, chunked):
+    monkeypatch.setattr(parsefit, 'local_test', False)
+    monkeypatch.setattr(parsefit, 'dump_parquet', False)
+    if chunked:
+        monkeypatch.setattr(parsefit, 'chunked_size', 0)
+    database = str(tmp_path / 'test.db')
+    create_tables(database, sportschema.sports)
+    db = {'dialect': 'sqlite', 'database': database}
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zip:
+        zip.writestr('ride.fit', synth_fit('cycling_outdoor', duration=600))
+        zip.writestr('empty.fit', recordless_fit())
+    archive.seek(0)
+    archive.filename = 'upload.zip'
+    try:
+        result = parsefit.fitfile(archive, ['cycling_outdoor'], db, workers)
+    finally:
+        hanawriter.close_pools()
+
+    assert result['new'] == 1
+    assert result['failed'] == 1
+    assert [error['file'] for error in result['errors']] == ['empty.fit']
+    conn = sqlite3.connect(database)
+    rows = conn.execute('SELECT COUNT(*) FROM "{}"'.format(sportschema.sports['cycling_outdoor']['table'])).fetchone()
+    conn.close()
+    assert rows[0] == 600
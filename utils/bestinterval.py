@@ -1,131 +1,149 @@
-from datetime import datetime, timedelta
-import math
+###
+# Best intervals of the workouts (mean-max) for several interval widths and metrics
+# Windows are counted in records (1 s recording, as the former rolling(600) window). Per TRAINING_ID the window
+# means come from cumulative sums, so every width/metric is one vectorized pass over the data.
+#
+#   from utils.bestinterval import best_intervals
+#   tdf = best_intervals(df, durations=[5, 60, 300], sport_type='CYCLING_OUTDOOR')
+#
+# Command line (from the repository root): python -m utils.bestinterval <dump> <best_interval.csv> [sport]
+# <dump>: the Parquet dump of parsefit (dumpstore) or a csv file
+###
+
+import os
 import sys
-import io
 import logging
-import pytz
-import os
-import pandas as pd
-import numpy as np
-
-
-att = {}
-interval_width = 600
-file = '/Users/Shared/data/triathlet/dump/bo2021.csv'
-att['table_name'] = os.path.basename(file).split('.')[0].upper()
-df = pd.read_csv(file,low_memory=False)
-df = df[['TRAINING_ID',"date","timestamp","elapsed_time","distance","heart_rate","cadence","power","temperature"]]
-
-col_map = {c:c.upper() for c in df.columns}
-col_map['workout_id'] = 'TRAINING_ID'
-col_map['heart_rate'] = 'HEARTRATE'
-
-df = df.rename(columns = col_map)
-
-####### same
-df['TIMESTAMP'] = pd.to_datetime(df.TIMESTAMP)
-
-# Time Series Index
-df['INDEX'] = df['TIMESTAMP']
-df = df.set_index('INDEX')
-#df.tz_localize('utc')
-#df = df.tz_convert(None)
-
-# Rolling average over Power and find max power
-df['POWER_RM'] = df.groupby(['TRAINING_ID'])['POWER'].rolling(interval_width).mean().droplevel(0)
-df['POWER_MAX'] = df.groupby(['TRAINING_ID'])['POWER_RM'].transform(max)
-
-
-# Timeindex of max power and get time intervals
-max_best = df[(df['POWER_RM'] == df['POWER_MAX']) & (df['POWER_MAX']>0)].index.values
-best_i = np.vstack((max_best - np.timedelta64(interval_width, 's'), max_best)).T
-
-num_trainings = len(df['TRAINING_ID'].unique())
-
-#log('# best intervals: {}  Number of trainings: {}'.format(len(best_i),num_trainings))
-
-best_list = list()
-milestone_counter = len(best_i) // 10
-for counter, bi in enumerate(best_i):
-    dfi = df[(df.index > bi[0]) & (df.index <= bi[1])]
-    best_list.append(dfi)
-    if counter % milestone_counter == 0:
-        print('Processed: {}/{}'.format(counter, len(best_i)))
-
-tdf = pd.concat(best_list)
-
-
-aggreg = {'DATE': 'first', 'TIMESTAMP': ['min', 'max'], \
-          'POWER': ['min', 'max', 'mean'], 'HEARTRATE': ['min', 'max', 'mean'], 'CADENCE': ['min', 'max', 'mean']}
-
-tdf = tdf.groupby('TRAINING_ID').agg(aggreg).reset_index()
-tdf.columns = ['_'.join(col).upper() for col in tdf.columns]
-
-tdf['SPORT_TYPE'] = att['table_name']
-tdf.rename(columns={"TRAINING_ID_": "TRAINING_ID", "DATE_FIRST": "DATE"}, inplace=True)
-
-tdf['DURATION'] = (tdf['TIMESTAMP_MAX'] - tdf['TIMESTAMP_MIN']).dt.total_seconds()
-tdf['TIMESTAMP_START'] = tdf['TIMESTAMP_MIN'].dt.strftime('%Y-%m-%d %H:%M:%S')
-tdf['TIMESTAMP_END'] = tdf['TIMESTAMP_MAX'].dt.strftime('%Y-%m-%d %H:%M:%S')
-tdf['INTERVAL_WIDTH'] = interval_width
-
-# cast
-tdf['DURATION'] = tdf['DURATION'].astype('int')
-tdf['HEARTRATE_MIN'] = tdf['HEARTRATE_MIN'].astype('int')
-tdf['HEARTRATE_MAX'] = tdf['HEARTRATE_MAX'].astype('int')
-tdf['HEARTRATE_MEAN'] = tdf['HEARTRATE_MEAN'].astype('int')
-tdf['CADENCE_MIN'] = tdf['CADENCE_MIN'].astype('float')
-tdf['CADENCE_MAX'] = tdf['CADENCE_MAX'].astype('float')
-tdf['CADENCE_MEAN'] = tdf['CADENCE_MEAN'].astype('float')
-tdf['POWER_MIN'] = tdf['POWER_MIN'].astype('float')
-tdf['POWER_MAX'] = tdf['POWER_MAX'].astype('float')
-tdf['POWER_MEAN'] = tdf['POWER_MEAN'].astype('float')
-tdf['INTERVAL_WIDTH'] = tdf['INTERVAL_WIDTH'].astype('int')
-
-# sort dataframe according to target table
-tdf = tdf[['TRAINING_ID', 'DATE', 'SPORT_TYPE', 'INTERVAL_WIDTH', 'TIMESTAMP_START', 'TIMESTAMP_END', \
-           'POWER_MIN', 'POWER_MAX', 'POWER_MEAN', 'HEARTRATE_MIN', 'HEARTRATE_MAX', \
-           'HEARTRATE_MEAN', 'CADENCE_MIN', 'CADENCE_MAX', 'CADENCE_MEAN']]
-
-att["table"] = {"columns": [
-    {"class": str(tdf[tdf.columns[0]].dtype), "tdf_name": tdf.columns[0], "name": "TRAINING_ID", "nullable": False,
-     "type": {"hana": "BIGINT"}},
-    {"class": str(tdf[tdf.columns[1]].dtype), "tdf_name": tdf.columns[1], "name": "DATE", "nullable": True,
-     "type": {"hana": "DAYDATE"}},
-    {"class": str(tdf[tdf.columns[2]].dtype), "tdf_name": tdf.columns[2], "name": "SPORT_TYPE", "nullable": False,
-     "size": 25, "type": {"hana": "NVARCHAR"}},
-    {"class": str(tdf[tdf.columns[3]].dtype), "tdf_name": tdf.columns[3], "name": "INTERVAL_WIDTH", "nullable": True,
-     "type": {"hana": "INTEGER"}},
-    {"class": str(tdf[tdf.columns[4]].dtype), "tdf_name": tdf.columns[4], "name": "TIMESTAMP_START", "nullable": True,
-     "type": {"hana": "LONGDATE"}},
-    {"class": str(tdf[tdf.columns[5]].dtype), "tdf_name": tdf.columns[5], "name": "TIMESTAMP_END", "nullable": True,
-     "type": {"hana": "LONGDATE"}},
-    {"class": str(tdf[tdf.columns[6]].dtype), "tdf_name": tdf.columns[6], "name": "POWER_MIN", "nullable": True,
-     "type": {"hana": "DOUBLE"}},
-    {"class": str(tdf[tdf.columns[7]].dtype), "tdf_name": tdf.columns[7], "name": "POWER_MAX", "nullable": True,
-     "type": {"hana": "DOUBLE"}},
-    {"class": str(tdf[tdf.columns[8]].dtype), "tdf_name": tdf.columns[8], "name": "POWER_MEAN", "nullable": True,
-     "type": {"hana": "DOUBLE"}},
-    {"class": str(tdf[tdf.columns[9]].dtype), "tdf_name": tdf.columns[9], "name": "HEARTRATE_MIN", "nullable": True,
-     "type": {"hana": "INTEGER"}},
-    {"class": str(tdf[tdf.columns[10]].dtype), "tdf_name": tdf.columns[10], "name": "HEARTRATE_MAX", "nullable": True,
-     "type": {"hana": "INTEGER"}},
-    {"class": str(tdf[tdf.columns[11]].dtype), "tdf_name": tdf.columns[11], "name": "HEARTRATE_MEAN", "nullable": True,
-     "type": {"hana": "INTEGER"}},
-    {"class": str(tdf[tdf.columns[12]].dtype), "tdf_name": tdf.columns[12], "name": "CADENCE_MIN", "nullable": True,
-     "type": {"hana": "DOUBLE"}},
-    {"class": str(tdf[tdf.columns[13]].dtype), "tdf_name": tdf.columns[13], "name": "CADENCE_MAX", "nullable": True,
-     "type": {"hana": "DOUBLE"}},
-    {"class": str(tdf[tdf.columns[14]].dtype), "tdf_name": tdf.columns[14], "name": "CADENCE_MEAN", "nullable": True,
-     "type": {"hana": "DOUBLE"}}], "name": "BEST_INTERVAL", "version": 1}
-
-#data = tdf.values.tolist()
-
-tdf.to_csv('/Users/Shared/data/triathlet/dump/best_interval.csv',index = False)
-
-
-
-
-
 
+import numpy as np
+import pandas as pd
 
+interval_widths = [5, 60, 300, 1200, 3600]  # seconds
+metrics = ['POWER', 'HEARTRATE', 'CADENCE']
+
+dump_columns = ['TRAINING_ID', 'date', 'timestamp', 'elapsed_time', 'distance', 'heart_rate', 'cadence', 'power',
+                'temperature']
+
+result_columns = ['TRAINING_ID', 'DATE', 'SPORT_TYPE', 'BEST_BY', 'INTERVAL_WIDTH', 'TIMESTAMP_START',
+                  'TIMESTAMP_END', 'POWER_MIN', 'POWER_MAX', 'POWER_MEAN', 'HEARTRATE_MIN', 'HEARTRATE_MAX',
+                  'HEARTRATE_MEAN', 'CADENCE_MIN', 'CADENCE_MAX', 'CADENCE_MEAN']
+
+
+def read_dump(file, sport=None):
+    if os.path.isdir(file):
+        import dumpstore
+        columns = [c for c in dump_columns + ['workout_id'] if c != 'TRAINING_ID']
+        df = dumpstore.read(file, sport, columns=columns)
+    else:
+        df = pd.read_csv(file, low_memory=False, usecols=lambda c: c in dump_columns or c == 'workout_id')
+    col_map = {c: c.upper() for c in df.columns}
+    col_map['workout_id'] = 'TRAINING_ID'
+    col_map['heart_rate'] = 'HEARTRATE'
+    df = df.rename(columns=col_map)
+    df['TIMESTAMP'] = pd.to_datetime(df['TIMESTAMP'])
+    return df
+
+
+def mean_max(values, durations=None):
+    # best mean of the values over each duration (records) of one workout, NaN if the workout is shorter
+    durations = durations or interval_widths
+    sums = np.concatenate(([0.], np.cumsum(np.asarray(values, dtype=np.float64))))
+    n = len(sums) - 1
+    return np.array([(sums[d:] - sums[:-d]).max() / d if 0 < d <= n else np.nan for d in durations])
+
+
+def window_reduce(ufunc, values, lo, hi):
+    # ufunc over values[lo:hi] for all windows at once (reduceat over interleaved start/end indices)
+    values = np.append(values, 0)
+    return ufunc.reduceat(values, np.column_stack((lo, hi)).ravel())[::2]
+
+
+def best_intervals(df, durations=None, by=None, sport_type=''):
+    # df: records with TRAINING_ID, DATE, TIMESTAMP, POWER, HEARTRATE, CADENCE (see read_dump)
+    # Returns one row per training, metric ('BEST_BY') and interval width with the stats of the best window.
+    durations = durations or interval_widths
+    by = by or metrics
+    df = df.sort_values(['TRAINING_ID', 'TIMESTAMP'], kind='stable')
+    n = len(df)
+    if n == 0:
+        return pd.DataFrame(columns=result_columns)
+
+    ids = df['TRAINING_ID'].to_numpy()
+    first = np.ones(n, dtype=bool)
+    first[1:] = ids[1:] != ids[:-1]
+    starts = np.flatnonzero(first)
+    group = np.cumsum(first) - 1
+    position = np.arange(n) - starts[group]
+
+    values = {m: pd.to_numeric(df[m], errors='coerce').fillna(0).to_numpy(dtype=np.float64) if m in df.columns
+              else np.zeros(n) for m in metrics}
+    sums = {m: np.concatenate(([0.], np.cumsum(v))) for m, v in values.items()}
+    timestamps = df['TIMESTAMP'].to_numpy()
+    dates = df['DATE'].to_numpy()
+
+    results = list()
+    for width in durations:
+        valid = position >= width - 1
+        end = np.flatnonzero(valid) + 1
+        if len(end) == 0:
+            continue
+        for metric in by:
+            mean = np.full(n, -np.inf)
+            mean[valid] = (sums[metric][end] - sums[metric][end - width]) / width
+            best = np.maximum.reduceat(mean, starts)
+            hit = np.flatnonzero((mean == best[group]) & (best[group] > 0))
+            # first best window per training
+            _, index = np.unique(group[hit], return_index=True)
+            hi = hit[index] + 1
+            lo = hi - width
+            result = {'TRAINING_ID': ids[lo], 'DATE': dates[lo], 'SPORT_TYPE': sport_type, 'BEST_BY': metric,
+                      'INTERVAL_WIDTH': width, 'TIMESTAMP_START': timestamps[lo], 'TIMESTAMP_END': timestamps[hi - 1]}
+            for m in metrics:
+                result[m + '_MIN'] = window_reduce(np.minimum, values[m], lo, hi)
+                result[m + '_MAX'] = window_reduce(np.maximum, values[m], lo, hi)
+                result[m + '_MEAN'] = (sums[m][hi] - sums[m][lo]) / width
+            results.append(pd.DataFrame(result))
+
+    if not results:
+        return pd.DataFrame(columns=result_columns)
+    tdf = pd.concat(results, ignore_index=True)
+    logging.info('# best intervals: {}  Number of trainings: {}'.format(len(tdf), len(starts)))
+
+    tdf['TIMESTAMP_START'] = tdf['TIMESTAMP_START'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    tdf['TIMESTAMP_END'] = tdf['TIMESTAMP_END'].dt.strftime('%Y-%m-%d %H:%M:%S')
+
+    # cast
+    tdf['INTERVAL_WIDTH'] = tdf['INTERVAL_WIDTH'].astype('int')
+    for col in ['HEARTRATE_MIN', 'HEARTRATE_MAX', 'HEARTRATE_MEAN']:
+        tdf[col] = tdf[col].astype('int')
+    for col in ['POWER_MIN', 'POWER_MAX', 'POWER_MEAN', 'CADENCE_MIN', 'CADENCE_MAX', 'CADENCE_MEAN']:
+        tdf[col] = tdf[col].astype('float')
+
+    # sort dataframe according to target table
+    return tdf[result_columns]
+
+
+def table_definition(tdf):
+    hana_types = {'TRAINING_ID': 'BIGINT', 'DATE': 'DAYDATE', 'SPORT_TYPE': 'NVARCHAR', 'BEST_BY': 'NVARCHAR',
+                  'INTERVAL_WIDTH': 'INTEGER', 'TIMESTAMP_START': 'LONGDATE', 'TIMESTAMP_END': 'LONGDATE',
+                  'HEARTRATE_MIN': 'INTEGER', 'HEARTRATE_MAX': 'INTEGER', 'HEARTRATE_MEAN': 'INTEGER'}
+    columns = list()
+    for col in tdf.columns:
+        column = {"class": str(tdf[col].dtype), "tdf_name": col, "name": col,
+                  "nullable": col not in ('TRAINING_ID', 'SPORT_TYPE', 'BEST_BY'),
+                  "type": {"hana": hana_types.get(col, 'DOUBLE')}}
+        if column['type']['hana'] == 'NVARCHAR':
+            column['size'] = 25
+        columns.append(column)
+    return {"columns": columns, "name": "BEST_INTERVAL", "version": 2}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 3:
+        print('Usage: python -m utils.bestinterval <dump> <best_interval.csv> [sport]')
+        sys.exit(1)
+    file = sys.argv[1]
+    sport = sys.argv[3] if len(sys.argv) > 3 else None
+    df = read_dump(file, sport)
+    tdf = best_intervals(df, sport_type=(sport or os.path.basename(file).split('.')[0]).upper())
+    tdf.to_csv(sys.argv[2], index=False)